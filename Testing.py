@@ -5,6 +5,7 @@ from datetime import datetime
 from data.PS_scraper import fetch_gen9ou_replays
 from data.PS_json_cleaner import clean_showdown_replay
 from data.POVConverter import convert_replay_for_rl_training
+from data import PS_http
 
 replays = fetch_gen9ou_replays(page=1, limit=10)
 
@@ -17,8 +18,8 @@ if replays:
     print(f"Replay URL: {first_replay['replay_url']}")
 
 
-    # Example replay URL
-    replay_url = "https://replay.pokemonshowdown.com/gen9ou-2497246974.json"
+    # Example replay URL (set PS_REPLAY_BASE_URL to use the local fixture server)
+    replay_url = PS_http.replay_url("gen9ou-2497246974.json")
     
     # Clean the replay first
     cleaned_data = clean_showdown_replay(replay_url)
@@ -0,0 +1,170 @@
+"""
+End-to-end throughput benchmark: fetch -> clean -> convert -> store, with no network
+
+Starts the local fixture server (data/PS_fixture_server.py), points the scraper and
+cleaner at it, and times each stage of the pipeline over a replicated fixture
+corpus. Runs can be recorded and replayed from disk, in which case no server is
+started at all.
+
+Replicated fixtures are copies of the same few games, so the duplicate filter is
+off unless --filter is given (it would keep only one copy of each).
+
+Usage:
+    python benchmarks/end_to_end.py [--replays 500] [--latency 0.02] [--throttle-rate 0.05]
+    python benchmarks/end_to_end.py --record cassettes/ && python benchmarks/end_to_end.py --replay cassettes/
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from data import PS_http
+from data.PS_fixture_server import FixtureServer, PAGE_SIZE
+from data.PS_scraper import fetch_gen9ou_replays
+from data.PS_json_cleaner import stream_showdown_replay
+from data.PS_filter import ReplayFilter
+from data.POVConverter import convert_many
+
+def open_store(kind, out_dir, replay_filter=None):
+    """Return (add(cleaned, perspectives), close()) for the chosen store"""
+    if kind == 'none':
+        return (lambda cleaned, perspectives: None), (lambda: None)
+
+    if kind == 'jsonl':
+        handle = open(os.path.join(out_dir, 'cleaned.jsonl'), 'w')
+        return (lambda cleaned, perspectives: handle.write(json.dumps(cleaned) + '\n')), handle.close
+
+    if kind == 'shards':
+        from data.PS_trajectories import TrajectoryShardWriter
+        writer = TrajectoryShardWriter(os.path.join(out_dir, 'shards'))
+
+        def add(cleaned, perspectives):
+            for perspective in perspectives.values():
+                writer.add(perspective)
+        return add, writer.close
+
+    from data.db import getConnection, createTable, insertJSON, closeConnection
+    cursor, conn = getConnection()
+    createTable(cursor)
+
+    def add(cleaned, perspectives):
+        if replay_filter is None:
+            insertJSON(cursor, conn, cleaned)
+        elif insertJSON(cursor, conn, cleaned, replay_filter.fingerprint_of(cleaned), replay_filter.tags_of(cleaned)):
+            replay_filter.mark_seen([cleaned])
+        else:
+            replay_filter.release([cleaned])
+    return add, closeConnection
+
+def run_pipeline(args, out_dir):
+    """Run every stage once; returns per-stage seconds and counts"""
+    timings = {}
+    counts = {}
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+
+    with quiet:
+        started = time.perf_counter()
+        max_pages = (args.replays - 1) // PAGE_SIZE + 1
+        listed = fetch_gen9ou_replays(limit=PAGE_SIZE, max_pages=max_pages)[:args.replays]
+        timings['search'] = time.perf_counter() - started
+        counts['listed'] = len(listed)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.fetch_workers) as executor:
+            cleaned = executor.map(stream_showdown_replay, [replay['replay_url'] for replay in listed])
+            cleaned = [replay for replay in cleaned if replay]
+        timings['fetch+clean'] = time.perf_counter() - started
+        counts['cleaned'] = len(cleaned)
+
+        replay_filter = None
+        if args.filter:
+            started = time.perf_counter()
+            replay_filter = ReplayFilter()
+            cleaned = list(replay_filter.filter(cleaned))
+            timings['filter'] = time.perf_counter() - started
+            counts['accepted'] = len(cleaned)
+
+        started = time.perf_counter()
+        converted = list(convert_many(cleaned, workers=args.workers))
+        timings['convert'] = time.perf_counter() - started
+        counts['converted'] = sum(perspectives is not None for _, perspectives in converted)
+
+        started = time.perf_counter()
+        add, close = open_store(args.store, out_dir, replay_filter)
+        for replay, (_, perspectives) in zip(cleaned, converted):
+            if perspectives is not None:
+                add(replay, perspectives)
+        close()
+        timings['store'] = time.perf_counter() - started
+
+    return timings, counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--replays', type=int, default=500, help="replays to push through the pipeline")
+    parser.add_argument('--latency', type=float, default=0.0, help="server seconds per response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random server seconds per response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--seed', type=int, default=0, help="fault injection seed")
+    parser.add_argument('--fetch-workers', type=int, default=8, help="concurrent downloads")
+    parser.add_argument('--workers', type=int, default=None, help="converter processes (1 = inline)")
+    parser.add_argument('--store', choices=('none', 'jsonl', 'shards', 'db'), default='jsonl')
+    parser.add_argument('--filter', action='store_true', help="run the duplicate/incomplete filter")
+    parser.add_argument('--record', metavar='DIR', help="record responses to DIR while running")
+    parser.add_argument('--replay', metavar='DIR', help="serve responses recorded in DIR; no server is started")
+    parser.add_argument('--verbose', action='store_true', help="keep the pipeline's per-replay output")
+    args = parser.parse_args()
+
+    server = None
+    if args.replay:
+        PS_http.set_transport(PS_http.ReplayTransport(args.replay))
+        with open(os.path.join(args.replay, 'base_url')) as f:
+            PS_http.set_base_url(f.read().strip())
+    else:
+        # Enough ids of the gen9ou fixture that the search alone can list them all
+        server = FixtureServer(
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate, retry_after=0, replicate=args.replays, seed=args.seed,
+        ).start()
+        PS_http.set_base_url(server.url)
+        if args.record:
+            PS_http.set_transport(PS_http.RecordingTransport(args.record))
+            with open(os.path.join(args.record, 'base_url'), 'w') as f:
+                f.write(server.url)
+        else:
+            PS_http.set_transport(PS_http.LiveTransport())
+
+    out_dir = tempfile.mkdtemp(prefix='ps_e2e_')
+    try:
+        started = time.perf_counter()
+        timings, counts = run_pipeline(args, out_dir)
+        total = time.perf_counter() - started
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if server is not None:
+            server.stop()
+
+    print(f"{'stage':<12} {'seconds':>9}")
+    for stage, seconds in timings.items():
+        print(f"{stage:<12} {seconds:>9.3f}")
+    print(f"counts: {counts}")
+    if server is not None:
+        print(f"server: {server.stats}")
+    print(f"throughput: {counts['converted'] / max(total, 1e-9):.1f} replays/s end to end ({total:.2f}s)")
+
+    if counts['converted'] == 0:
+        print("No replays made it through the pipeline")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
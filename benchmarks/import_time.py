@@ -0,0 +1,76 @@
+"""
+Import-time benchmark for the data package
+
+Imports each module in a fresh interpreter, reports the median cumulative import
+time from `python -X importtime`, and checks that no network, database or heavy
+optional dependency was pulled in along the way.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'data.PS_vocab',
+    'data.PS_json_cleaner',
+    'data.POVConverter',
+    'data.PS_filter',
+    'data.PS_reconstruct',
+    'data.PS_trajectories',
+    'data.PS_analytics',
+    'data.PS_ingest',
+    'data.PS_http',
+    'data.PS_scraper',
+    'data.db',
+]
+
+# Must only load when actually used
+HEAVY_MODULES = ('requests', 'mysql', 'numpy', 'multiprocessing', 'socket', 'ssl')
+
+CHECK = (
+    "import sys, {module}; "
+    "print(','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy!r}))))"
+)
+
+def import_time_us(module):
+    """Cumulative import time of module in microseconds, plus any heavy modules it loaded"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHECK.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    cumulative = None
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1])
+    loaded = [name for name in result.stdout.strip().split(',') if name]
+    return cumulative, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<24} {'median ms':>10}  heavy imports")
+    for module in MODULES:
+        times = []
+        loaded = []
+        for _ in range(args.runs):
+            cumulative, loaded = import_time_us(module)
+            times.append(cumulative)
+        print(f"{module:<24} {statistics.median(times) / 1000:>10.2f}  {', '.join(loaded) or '-'}")
+        failed = failed or bool(loaded)
+
+    if failed:
+        print("Some modules load network/database/optional dependencies at import time")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
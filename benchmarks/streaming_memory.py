@@ -0,0 +1,123 @@
+"""
+Peak-memory check for streaming replay cleaning
+
+Builds a synthetic long replay by repeating a typical turn, feeds its
+JSON through iter_replay_stream in fixed-size chunks while discarding each turn as
+it arrives, and checks with tracemalloc that peak memory stays bounded by the
+largest turn and the chunk size rather than the size of the replay. The in-memory
+clean_replay_data path is measured alongside for comparison.
+
+Usage:
+    python benchmarks/streaming_memory.py [--turns 20000] [--chunk-size 65536]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from data.PS_json_cleaner import clean_replay_data, iter_replay_stream
+
+# Streaming may hold a few copies of the turn being built plus the chunk buffer
+TURN_FACTOR = 8
+CHUNK_FACTOR = 4
+# Generator frames, decoder state and the fields dict, independent of replay size
+FIXED_ALLOWANCE = 16 * 1024
+
+PRE_BATTLE = [
+    '|j|p1', '|j|p2', '|player|p1|p1|1|1500', '|player|p2|p2|2|1500',
+    '|teamsize|p1|6', '|teamsize|p2|6', '|gen|9', '|tier|[Gen 9] OU', '|start',
+    '|switch|p1a: Gholdengo|Gholdengo|100/100', '|switch|p2a: Great Tusk|Great Tusk, M|100/100',
+]
+
+# One turn of a typical exchange; hp varies so turns aren't byte-identical
+TURN_TEMPLATE = [
+    '|move|p1a: Gholdengo|Make It Rain|p2a: Great Tusk',
+    '|-supereffective|p2a: Great Tusk',
+    '|-damage|p2a: Great Tusk|{hp}/100',
+    '|-unboost|p1a: Gholdengo|spa|1',
+    '|move|p2a: Great Tusk|Headlong Rush|p1a: Gholdengo',
+    '|-damage|p1a: Gholdengo|{hp}/100',
+    '|-enditem|p1a: Gholdengo|Air Balloon',
+    '|c|p1|gl',
+    '|upkeep',
+]
+
+def synthetic_replay(num_turns):
+    """Raw replay JSON bytes with num_turns turns, plus the size of its largest turn"""
+    log = list(PRE_BATTLE)
+    largest = 0
+    for number in range(1, num_turns + 1):
+        hp = 100 - number % 100
+        block = [f'|turn|{number}'] + [line.format(hp=hp) for line in TURN_TEMPLATE]
+        # Keep the chat-like noise the cleaner drops so filtering is exercised too
+        block.append(f'|t:|{1700000000 + number}')
+        log.extend(block)
+        largest = max(largest, len('\n'.join(block).encode()))
+    replay = {
+        'id': 'gen9ou-synthetic',
+        'format': '[Gen 9] OU',
+        'players': ['p1', 'p2'],
+        'log': '\n'.join(log),
+        'inputlog': '\n'.join('>p1 move 1' for _ in range(num_turns)),
+    }
+    return json.dumps(replay).encode(), largest
+
+def streamed_peak(data, chunk_size):
+    """Peak traced bytes while streaming data, and the number of turns seen"""
+    def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    gc.collect()
+    tracemalloc.start()
+    turns = 0
+    for kind, _ in iter_replay_stream(chunks()):
+        turns += kind == 'turn'
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, turns
+
+def in_memory_peak(data):
+    """Peak traced bytes for json.loads + clean_replay_data on the whole body"""
+    gc.collect()
+    tracemalloc.start()
+    cleaned = clean_replay_data(json.loads(data))
+    turns = len(cleaned['turns'])
+    del cleaned
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, turns
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--turns', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    data, largest_turn = synthetic_replay(args.turns)
+    limit = TURN_FACTOR * largest_turn + CHUNK_FACTOR * args.chunk_size + FIXED_ALLOWANCE
+
+    # Warm up vocabulary and regex caches so only per-replay memory is traced
+    streamed_peak(synthetic_replay(10)[0], args.chunk_size)
+    stream_peak, stream_turns = streamed_peak(data, args.chunk_size)
+    memory_peak, memory_turns = in_memory_peak(data)
+
+    print(f"replay size:      {len(data) / 1024:>10.1f} KiB ({args.turns} turns)")
+    print(f"largest turn:     {largest_turn / 1024:>10.1f} KiB")
+    print(f"streaming peak:   {stream_peak / 1024:>10.1f} KiB (limit {limit / 1024:.1f} KiB)")
+    print(f"in-memory peak:   {memory_peak / 1024:>10.1f} KiB")
+
+    if stream_turns != memory_turns:
+        print(f"Streaming saw {stream_turns} turns, in-memory cleaning saw {memory_turns}")
+        sys.exit(1)
+    if stream_peak > limit:
+        print("Streaming peak memory is not bounded by turn and chunk size")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
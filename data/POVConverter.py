@@ -1,7 +1,16 @@
 import json
-import re
 import copy
-from typing import Dict, List, Any, Optional
+import sys
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
+
+try:
+    from .PS_vocab import Vocabulary, get_vocabulary
+    from .PS_reconstruct import HiddenInfoReconstructor, UsagePriors
+    from .PS_trajectories import TrajectoryBuilder
+except ImportError:
+    from PS_vocab import Vocabulary, get_vocabulary
+    from PS_reconstruct import HiddenInfoReconstructor, UsagePriors
+    from PS_trajectories import TrajectoryBuilder
 
 class FirstPersonConverter:
     """
@@ -9,8 +18,19 @@ class FirstPersonConverter:
     for reinforcement learning training.
     """
     
-    def __init__(self):
+    def __init__(self, vocabulary: Optional[Vocabulary] = None,
+                 reconstructor: Optional[HiddenInfoReconstructor] = None,
+                 shaping: Optional[Dict[str, float]] = None):
         self.player_perspectives = {}
+        # Shared intern tables: positions, species, moves, etc. are parsed once
+        # and every event references the same string objects
+        self.vocab = vocabulary if vocabulary is not None else get_vocabulary()
+        # Optional stage that fills in hidden information from usage priors
+        self.reconstructor = reconstructor
+        # Optional shaped reward weights for the trajectory arrays (see TrajectoryBuilder)
+        self.shaping = shaping
+        # Effect names without the '-' prefix, keyed by protocol message type
+        self._effect_types = {}
         
     def convert_replay_to_first_person(self, cleaned_replay: Dict) -> Dict[str, Dict]:
         """
@@ -28,6 +48,7 @@ class FirstPersonConverter:
             
         # Initialize perspectives for each player
         perspectives = {}
+        builders = {}
         for i, player in enumerate(players):
             player_id = f"p{i+1}"
             perspectives[player] = {
@@ -45,16 +66,25 @@ class FirstPersonConverter:
                 'action_history': [],
                 'observations': []
             }
+            builders[player] = TrajectoryBuilder(player_id, player, self.vocab, self.shaping)
+            builders[player].observe_pre_battle(perspectives[player]['pre_battle'])
             
-        # Convert each turn
+        # Convert each turn, feeding the trajectory builders as we go
         turns = cleaned_replay.get('turns', {})
         for turn_num, turn_actions in turns.items():
             for player in players:
                 player_id = f"p{players.index(player)+1}"
-                perspectives[player]['turns'][turn_num] = self._convert_turn_to_first_person(
-                    turn_actions, player_id, turn_num
-                )
-                
+                fp_turn = self._convert_turn_to_first_person(turn_actions, player_id, turn_num)
+                perspectives[player]['turns'][turn_num] = fp_turn
+                builders[player].observe_turn(turn_num, fp_turn)
+
+        for player in players:
+            perspectives[player]['trajectory'] = builders[player].finish()
+            perspectives[player]['action_history'] = builders[player].action_history
+
+        if self.reconstructor is not None:
+            self.reconstructor.reconstruct(cleaned_replay, perspectives)
+
         return perspectives
     
     def _initialize_game_state(self) -> Dict:
@@ -176,9 +206,9 @@ class FirstPersonConverter:
         if len(parts) < 4:
             return {'type': 'move', 'perspective': 'neutral', 'data': {'raw': '|'.join(parts)}}
             
-        user = parts[2]
-        move = parts[3]
-        target = parts[4] if len(parts) > 4 else None
+        user = self.vocab.position(parts[2])
+        move = self.vocab.canonical('moves', parts[3])
+        target = self.vocab.position(parts[4]) if len(parts) > 4 else None
         
         user_player = self._extract_player_from_position(user)
         perspective = 'self' if user_player == player_id else 'opponent'
@@ -202,7 +232,7 @@ class FirstPersonConverter:
         if len(parts) < 4:
             return {'type': 'switch', 'perspective': 'neutral', 'data': {'raw': '|'.join(parts)}}
             
-        position = parts[2]
+        position = self.vocab.position(parts[2])
         pokemon_info = parts[3]
         hp_info = parts[4] if len(parts) > 4 else None
         
@@ -229,7 +259,7 @@ class FirstPersonConverter:
         if len(parts) < 3:
             return {'type': 'faint', 'perspective': 'neutral', 'data': {'raw': '|'.join(parts)}}
             
-        position = parts[2]
+        position = self.vocab.position(parts[2])
         fainting_player = self._extract_player_from_position(position)
         perspective = 'self' if fainting_player == player_id else 'opponent'
         
@@ -244,12 +274,16 @@ class FirstPersonConverter:
     
     def _handle_battle_effect(self, parts: List[str], player_id: str) -> Dict:
         """Handle battle effects like damage, healing, status, etc."""
-        effect_type = parts[1][1:]  # Remove the '-' prefix
+        # The vocabulary keeps the protocol form ('-damage'), as the cleaner does
+        msg_type = self.vocab.canonical('message_types', parts[1])
+        effect_type = self._effect_types.get(msg_type)
+        if effect_type is None:
+            effect_type = self._effect_types[msg_type] = sys.intern(msg_type[1:])  # Remove the '-' prefix
         
         if len(parts) < 3:
             return {'type': effect_type, 'perspective': 'neutral', 'data': {'raw': '|'.join(parts)}}
         
-        target = parts[2]
+        target = self.vocab.position(parts[2])
         target_player = self._extract_player_from_position(target)
         perspective = 'self' if target_player == player_id else 'opponent'
         
@@ -273,6 +307,12 @@ class FirstPersonConverter:
         elif effect_type == 'status':
             if len(parts) > 3:
                 effect_data['data']['status_condition'] = parts[3]
+        elif effect_type == 'ability':
+            if len(parts) > 3:
+                effect_data['data']['effect_details'][0] = self.vocab.canonical('abilities', parts[3])
+        elif effect_type in ('item', 'enditem'):
+            if len(parts) > 3:
+                effect_data['data']['effect_details'][0] = self.vocab.canonical('items', parts[3])
                 
         return effect_data
     
@@ -286,32 +326,126 @@ class FirstPersonConverter:
     
     def _extract_player_from_position(self, position: str) -> Optional[str]:
         """Extract player ID from position string like 'p1a: Charizard'"""
-        if not position:
-            return None
-        match = re.match(r'^(p[12])', position)
-        return match.group(1) if match else None
+        return self.vocab.split_position(position)[0]
     
     def _extract_pokemon_name(self, position: str) -> Optional[str]:
         """Extract Pokemon name from position string"""
-        if not position or ':' not in position:
-            return None
-        return position.split(': ')[1].strip()
+        return self.vocab.split_position(position)[1]
     
     def _extract_pokemon_name_from_info(self, pokemon_info: str) -> str:
         """Extract Pokemon name from info string like 'Charizard, L50, M'"""
-        if not pokemon_info:
-            return ''
-        return pokemon_info.split(',')[0].strip()
+        return self.vocab.species_from_info(pokemon_info)
 
-def convert_replay_for_rl_training(cleaned_replay_data: Dict) -> Dict[str, Dict]:
+def convert_replay_for_rl_training(cleaned_replay_data: Dict,
+                                   reconstructor: Optional[HiddenInfoReconstructor] = None,
+                                   shaping: Optional[Dict[str, float]] = None) -> Dict[str, Dict]:
     """
     Main function to convert cleaned replay data to first-person perspectives
     
     Args:
         cleaned_replay_data: Output from the replay cleaner
+        reconstructor: Optional hidden-information reconstruction stage
+        shaping: Optional shaped reward weights, e.g. {'faint': 0.1, 'hp': 0.05}
         
     Returns:
         Dictionary with player names as keys and their RL training data as values
     """
-    converter = FirstPersonConverter()
+    converter = FirstPersonConverter(reconstructor=reconstructor, shaping=shaping)
     return converter.convert_replay_to_first_person(cleaned_replay_data)
+
+
+# Converter owned by the current pool worker, created once by _init_worker
+_worker_converter = None
+
+def create_converter(priors_path: Optional[str] = None,
+                     shaping: Optional[Dict[str, float]] = None) -> FirstPersonConverter:
+    """Build a converter (with reconstruction when priors_path is given) to reuse across calls"""
+    reconstructor = None
+    if priors_path:
+        reconstructor = HiddenInfoReconstructor(UsagePriors.load(priors_path))
+    return FirstPersonConverter(reconstructor=reconstructor, shaping=shaping)
+
+def _init_worker(priors_path: Optional[str] = None, shaping: Optional[Dict[str, float]] = None):
+    """Create the converter a pool worker reuses for every replay it handles"""
+    global _worker_converter
+    _worker_converter = create_converter(priors_path, shaping)
+
+def _convert_in_worker(cleaned_replay: Dict) -> Tuple[str, Optional[Dict[str, Dict]]]:
+    """Convert one cleaned replay inside a pool worker, tagged with its replay id"""
+    replay_id = cleaned_replay.get('id', 'unknown')
+    try:
+        return replay_id, _worker_converter.convert_replay_to_first_person(cleaned_replay)
+    except Exception as e:
+        print(f"Error converting replay {replay_id}: {e}")
+        return replay_id, None
+
+def create_pool(workers: Optional[int] = None, priors_path: Optional[str] = None,
+                shaping: Optional[Dict[str, float]] = None):
+    """
+    Start a converter pool that can be passed to convert_many across many calls
+
+    Long-running callers (e.g. streaming ingest) use this to avoid paying pool
+    start-up for every micro-batch. The caller closes the pool.
+    """
+    import multiprocessing
+
+    return multiprocessing.Pool(workers, initializer=_init_worker, initargs=(priors_path, shaping))
+
+def convert_many(cleaned_replays: Iterable[Dict], workers: Optional[int] = None,
+                 chunksize: int = 16, ordered: bool = True,
+                 priors_path: Optional[str] = None,
+                 shaping: Optional[Dict[str, float]] = None,
+                 pool=None) -> Iterator[Tuple[str, Optional[Dict[str, Dict]]]]:
+    """
+    Convert many cleaned replays to first-person perspectives across processes
+
+    Replays and results cross process boundaries as ordinary pickles; the
+    perspectives are returned in full so callers can keep using them as dicts.
+
+    Args:
+        cleaned_replays: Iterable of outputs from the replay cleaner
+        workers: Number of worker processes (defaults to the CPU count, 1 converts inline)
+        chunksize: Number of replays handed to a worker at a time
+        ordered: Yield results in input order; False yields them as they finish
+        priors_path: Usage priors file; when given, each worker runs hidden-information
+            reconstruction with the priors loaded once per worker
+        shaping: Optional shaped reward weights for the trajectory arrays
+        pool: Pool from create_pool() to reuse; workers, priors_path and shaping are
+            then taken from the pool
+
+    Returns:
+        An iterator of (replay_id, perspectives) pairs, in input order or completion
+        order; perspectives are as returned by convert_replay_for_rl_training, or
+        None for replays that fail to convert
+    """
+    import multiprocessing
+
+    if pool is not None:
+        yield from _imap_replays(pool, cleaned_replays, chunksize, ordered)
+        return
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        yield from convert_inline(create_converter(priors_path, shaping), cleaned_replays)
+        return
+
+    with create_pool(workers, priors_path, shaping) as pool:
+        yield from _imap_replays(pool, cleaned_replays, chunksize, ordered)
+
+def convert_inline(converter: FirstPersonConverter,
+                   cleaned_replays: Iterable[Dict]) -> Iterator[Tuple[str, Optional[Dict[str, Dict]]]]:
+    """convert_many in the current process with an existing converter (same results)"""
+    for cleaned_replay in cleaned_replays:
+        replay_id = cleaned_replay.get('id', 'unknown')
+        try:
+            perspectives = converter.convert_replay_to_first_person(cleaned_replay)
+        except Exception as e:
+            print(f"Error converting replay {replay_id}: {e}")
+            perspectives = None
+        yield replay_id, perspectives
+
+def _imap_replays(pool, cleaned_replays: Iterable[Dict], chunksize: int, ordered: bool):
+    imap = pool.imap if ordered else pool.imap_unordered
+    yield from imap(_convert_in_worker, cleaned_replays, chunksize)
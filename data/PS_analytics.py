@@ -0,0 +1,432 @@
+"""
+Corpus analytics over the stored replays
+
+Computes species usage, teammate co-occurrence, move frequency, lead matchups and
+species win rate by rating bucket, separately for each format. Rows are parsed in
+parallel chunks and counted with NumPy over interned vocabulary ids. Totals are
+checkpointed together with the id of the last row seen, so a rerun only processes
+replays added since then.
+
+Usage:
+    python data/PS_analytics.py analytics/ [--workers 8] [--chunk-size 2000]
+"""
+import argparse
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from .PS_vocab import Vocabulary, get_vocabulary, save_vocabulary
+except ImportError:
+    from PS_vocab import Vocabulary, get_vocabulary, save_vocabulary
+
+# Lower edges of the rating buckets; games below the first edge (or unrated) go in bucket 0
+RATING_EDGES = (1100, 1300, 1500, 1700, 1900)
+NUM_BUCKETS = len(RATING_EDGES) + 1
+
+STATE_FILE = 'state.npz'
+# Version 2 keeps every count per format
+STATE_VERSION = 2
+VOCAB_FILE = 'vocab.json'
+RESULTS_FILE = 'results.json'
+
+def rating_bucket_labels() -> List[str]:
+    edges = (0,) + RATING_EDGES
+    return [f'{low}+' if i == len(edges) - 1 else f'{low}-{edges[i + 1] - 1}' for i, low in enumerate(edges)]
+
+# Base vocabulary each worker starts from, set by _init_worker
+_worker_base = None
+
+def _init_worker(base_vocab: Dict):
+    global _worker_base
+    _worker_base = base_vocab
+
+def _extract(replay: Dict, vocab: Vocabulary):
+    """Teams, leads, moves and winning side of one cleaned replay, as vocabulary ids"""
+    teams = {'p1': [], 'p2': []}
+    leads = {}
+    moves = []
+    winner_name = None
+
+    for line in replay.get('pre_battle', []):
+        parts = line.split('|')
+        if len(parts) < 4:
+            continue
+        if parts[1] == 'poke' and parts[2] in teams:
+            teams[parts[2]].append(vocab.intern('species', vocab.species_from_info(parts[3])))
+        elif parts[1] == 'switch':
+            side = parts[2][:2]
+            if side in teams and side not in leads:
+                leads[side] = vocab.intern('species', vocab.species_from_info(parts[3]))
+
+    for turn_actions in replay.get('turns', {}).values():
+        for line in turn_actions:
+            if line.startswith('|move|'):
+                parts = line.split('|')
+                if len(parts) > 3:
+                    moves.append(vocab.intern('moves', parts[3]))
+            elif line.startswith('|win|'):
+                winner_name = line[len('|win|'):]
+
+    players = replay.get('players', [])
+    winner = None
+    if winner_name is not None and winner_name in players:
+        winner = f'p{players.index(winner_name) + 1}'
+    return teams, leads, moves, winner
+
+# Per-format count arrays kept in the state file, all indexed by vocabulary ids
+COUNT_ARRAYS = ('species_usage', 'species_games', 'species_wins', 'move_counts')
+
+def _count_format(counts: Dict, num_species: int, num_moves: int) -> Dict:
+    """Turn one format's collected ids into bincounts and unique pair/lead codes"""
+    import numpy as np
+
+    species = np.asarray(counts['team_species'], dtype=np.int64)
+    cells = np.asarray(counts['team_buckets'], dtype=np.int64) * num_species + species
+    won = np.asarray(counts['team_won'], dtype=np.float64)
+
+    pair_codes = np.asarray([a * num_species + b for a, b in counts['pairs']], dtype=np.int64)
+    pair_codes, pair_counts = np.unique(pair_codes, return_counts=True)
+
+    lead_array = np.asarray(counts['leads'], dtype=np.int64).reshape(-1, 3)
+    lead_codes = lead_array[:, 0] * num_species + lead_array[:, 1]
+    lead_codes, lead_index, lead_counts = np.unique(lead_codes, return_inverse=True, return_counts=True)
+    lead_wins = np.bincount(lead_index.ravel(), weights=lead_array[:, 2], minlength=len(lead_codes))
+
+    return {
+        'games': counts['games'],
+        'species_usage': np.bincount(species, minlength=num_species),
+        'species_games': np.bincount(cells, minlength=NUM_BUCKETS * num_species).reshape(NUM_BUCKETS, num_species),
+        'species_wins': np.bincount(cells, weights=won, minlength=NUM_BUCKETS * num_species).reshape(NUM_BUCKETS, num_species),
+        'move_counts': np.bincount(np.asarray(counts['moves'], dtype=np.int64), minlength=num_moves),
+        'pair_codes': pair_codes,
+        'pair_counts': pair_counts,
+        'lead_codes': lead_codes,
+        'lead_counts': lead_counts,
+        'lead_wins': lead_wins,
+    }
+
+def _count_chunk(rows: List[Tuple[int, str, Optional[float]]]) -> Dict:
+    """
+    Count one chunk of (row id, json text, elo) rows inside a worker, per format
+
+    Ids are local to the worker's vocabulary; the strings it added beyond the base
+    vocabulary are returned so the parent can remap them into the shared id space.
+    """
+    import numpy as np
+
+    vocab = Vocabulary.from_dict(_worker_base)
+    base_species = vocab.size('species')
+    base_moves = vocab.size('moves')
+
+    formats = {}
+    for _, json_text, elo in rows:
+        try:
+            replay = json.loads(json_text)
+        except ValueError:
+            continue
+        fmt = replay.get('format', '')
+        counts = formats.get(fmt)
+        if counts is None:
+            counts = formats[fmt] = {
+                'games': 0, 'team_species': [], 'team_buckets': [], 'team_won': [],
+                'pairs': [], 'moves': [], 'leads': [],
+            }
+        counts['games'] += 1
+        bucket = int(np.searchsorted(RATING_EDGES, elo or 0, side='right'))
+        teams, lead, game_moves, winner = _extract(replay, vocab)
+
+        for side, team in teams.items():
+            won = winner == side
+            counts['team_species'].extend(team)
+            counts['team_buckets'].extend([bucket] * len(team))
+            counts['team_won'].extend([won] * len(team))
+            unique = sorted(set(team))
+            counts['pairs'].extend((a, b) for i, a in enumerate(unique) for b in unique[i + 1:])
+        counts['moves'].extend(game_moves)
+        if 'p1' in lead and 'p2' in lead:
+            counts['leads'].append((lead['p1'], lead['p2'], winner == 'p1'))
+
+    num_species = vocab.size('species')
+    num_moves = vocab.size('moves')
+    return {
+        'last_id': max((row[0] for row in rows), default=0),
+        'num_species': num_species,
+        'species_tail': vocab.strings['species'][base_species:],
+        'moves_tail': vocab.strings['moves'][base_moves:],
+        'base_species': base_species,
+        'base_moves': base_moves,
+        'formats': {fmt: _count_format(counts, num_species, num_moves) for fmt, counts in formats.items()},
+    }
+
+def _grow(array, size: int, axis: int = -1):
+    """Zero-pad a NumPy array along axis up to size"""
+    import numpy as np
+
+    missing = size - array.shape[axis]
+    if missing <= 0:
+        return array
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (0, missing)
+    return np.pad(array, pad)
+
+class FormatTotals:
+    """Running counts for one format, indexed by ids from the analytics vocabulary"""
+
+    def __init__(self, np):
+        self.np = np
+        self.games = 0
+        self.species_usage = np.zeros(0, dtype=np.int64)
+        self.species_games = np.zeros((NUM_BUCKETS, 0), dtype=np.int64)
+        self.species_wins = np.zeros((NUM_BUCKETS, 0), dtype=np.float64)
+        self.move_counts = np.zeros(0, dtype=np.int64)
+        self.pairs = {}
+        self.leads = {}
+
+    def merge(self, counts: Dict, species_map, moves_map, local_species: int, num_species: int, num_moves: int):
+        """Fold one chunk's counts for this format in, remapping local ids"""
+        np = self.np
+        self.species_usage = _grow(self.species_usage, num_species)
+        self.species_games = _grow(self.species_games, num_species)
+        self.species_wins = _grow(self.species_wins, num_species)
+        self.move_counts = _grow(self.move_counts, num_moves)
+
+        np.add.at(self.species_usage, species_map, counts['species_usage'])
+        np.add.at(self.species_games, (slice(None), species_map), counts['species_games'])
+        np.add.at(self.species_wins, (slice(None), species_map), counts['species_wins'])
+        np.add.at(self.move_counts, moves_map, counts['move_counts'])
+
+        a, b = np.divmod(counts['pair_codes'], local_species)
+        for a_id, b_id, count in zip(species_map[a].tolist(), species_map[b].tolist(), counts['pair_counts'].tolist()):
+            key = (a_id, b_id) if a_id < b_id else (b_id, a_id)
+            self.pairs[key] = self.pairs.get(key, 0) + count
+
+        a, b = np.divmod(counts['lead_codes'], local_species)
+        for a_id, b_id, count, wins in zip(species_map[a].tolist(), species_map[b].tolist(),
+                                           counts['lead_counts'].tolist(), counts['lead_wins'].tolist()):
+            entry = self.leads.setdefault((a_id, b_id), [0, 0])
+            entry[0] += count
+            entry[1] += int(wins)
+
+        self.games += counts['games']
+
+    def to_state(self, prefix: str) -> Dict:
+        """Arrays for the state file, keys prefixed so formats can share one .npz"""
+        np = self.np
+        state = {f'{prefix}{name}': getattr(self, name) for name in COUNT_ARRAYS}
+        state[f'{prefix}games'] = self.games
+        state[f'{prefix}pairs'] = np.asarray([(a, b, n) for (a, b), n in self.pairs.items()],
+                                             dtype=np.int64).reshape(-1, 3)
+        state[f'{prefix}leads'] = np.asarray([(a, b, n, w) for (a, b), (n, w) in self.leads.items()],
+                                             dtype=np.int64).reshape(-1, 4)
+        return state
+
+    @classmethod
+    def from_state(cls, np, state, prefix: str) -> 'FormatTotals':
+        totals = cls(np)
+        for name in COUNT_ARRAYS:
+            setattr(totals, name, state[f'{prefix}{name}'])
+        totals.games = int(state[f'{prefix}games'])
+        totals.pairs = {(a, b): n for a, b, n in state[f'{prefix}pairs'].tolist()}
+        totals.leads = {(a, b): [n, w] for a, b, n, w in state[f'{prefix}leads'].tolist()}
+        return totals
+
+    def results(self, vocab: Vocabulary, top: int = 50) -> Dict:
+        """Readable summary of the top entries for each statistic"""
+        np = self.np
+        species = vocab.strings['species']
+        moves = vocab.strings['moves']
+        teams = max(2 * self.games, 1)
+
+        usage_order = np.argsort(-self.species_usage)[:top]
+        move_order = np.argsort(-self.move_counts)[:top]
+        games = self.species_games
+        with np.errstate(divide='ignore', invalid='ignore'):
+            win_rates = np.where(games > 0, self.species_wins / np.maximum(games, 1), np.nan)
+
+        return {
+            'games': self.games,
+            'species_usage': [
+                {'species': species[i], 'teams': int(self.species_usage[i]),
+                 'usage': float(self.species_usage[i] / teams)}
+                for i in usage_order if self.species_usage[i] > 0
+            ],
+            'teammates': [
+                {'pair': [species[a], species[b]], 'teams': n}
+                for (a, b), n in sorted(self.pairs.items(), key=lambda item: -item[1])[:top]
+            ],
+            'move_frequency': [
+                {'move': moves[i], 'uses': int(self.move_counts[i])}
+                for i in move_order if self.move_counts[i] > 0
+            ],
+            'lead_matchups': [
+                {'p1_lead': species[a], 'p2_lead': species[b], 'games': n, 'p1_win_rate': w / n}
+                for (a, b), (n, w) in sorted(self.leads.items(), key=lambda item: -item[1][0])[:top]
+            ],
+            'win_rate_by_rating': {
+                label: [
+                    {'species': species[i], 'games': int(games[bucket, i]), 'win_rate': float(win_rates[bucket, i])}
+                    for i in usage_order if games[bucket, i] > 0
+                ]
+                for bucket, label in enumerate(rating_bucket_labels())
+            },
+        }
+
+class CorpusAnalytics:
+    """
+    Running totals over the replay corpus, kept in a directory between runs
+
+    Counts are kept per format, so usage and win rates are only ever computed
+    against games of the same format. All of them are indexed by ids from the
+    directory's own vocabulary, seeded from the shared one and only ever grown,
+    so totals from earlier runs stay valid as new replays arrive.
+    """
+
+    def __init__(self, out_dir: str):
+        import numpy as np  # Loaded here so importing the module stays light
+        self.np = np
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        vocab_path = os.path.join(out_dir, VOCAB_FILE)
+        self.vocab = Vocabulary.load(vocab_path) if os.path.exists(vocab_path) else get_vocabulary()
+
+        self.last_id = 0
+        self.formats = {}
+
+        state_path = os.path.join(out_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            with np.load(state_path) as state:
+                version = int(state['version']) if 'version' in state.files else 1
+                if version != STATE_VERSION:
+                    raise ValueError(f"Unsupported analytics state version {version} in {state_path}, "
+                                     f"expected {STATE_VERSION}; remove the directory to rebuild it")
+                self.last_id = int(state['last_id'])
+                for i, fmt in enumerate(state['formats'].tolist()):
+                    self.formats[fmt] = FormatTotals.from_state(np, state, f'{i}_')
+
+    @property
+    def games(self) -> int:
+        return sum(totals.games for totals in self.formats.values())
+
+    def _remap(self, tail: List[str], base: int, category: str):
+        """Array mapping a worker's local ids to ids in our vocabulary"""
+        np = self.np
+        local_new = [self.vocab.intern(category, value) for value in tail]
+        return np.concatenate([np.arange(base, dtype=np.int64), np.asarray(local_new, dtype=np.int64)])
+
+    def merge(self, chunk: Dict):
+        """Fold one worker chunk into the totals"""
+        species_map = self._remap(chunk['species_tail'], chunk['base_species'], 'species')
+        moves_map = self._remap(chunk['moves_tail'], chunk['base_moves'], 'moves')
+        num_species = self.vocab.size('species')
+        num_moves = self.vocab.size('moves')
+
+        for fmt, counts in chunk['formats'].items():
+            totals = self.formats.get(fmt)
+            if totals is None:
+                totals = self.formats[fmt] = FormatTotals(self.np)
+            totals.merge(counts, species_map, moves_map, chunk['num_species'], num_species, num_moves)
+
+        self.last_id = max(self.last_id, chunk['last_id'])
+
+    def update(self, row_chunks: Iterable[List[Tuple[int, str, Optional[float]]]], workers: int = 1,
+               checkpoint_every: int = 10) -> int:
+        """
+        Count new rows, checkpointing totals and the row watermark as chunks finish
+
+        Args:
+            row_chunks: Lists of (row id, cleaned replay json, elo), in increasing id order
+            workers: Worker processes to parse and count chunks in
+            checkpoint_every: Save state after this many chunks
+
+        Returns:
+            Number of games added
+        """
+        import multiprocessing
+
+        base = self.vocab.to_dict()
+        before = self.games
+        if workers <= 1:
+            _init_worker(base)
+            results = map(_count_chunk, row_chunks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(base,))
+            # In order, so the saved watermark never skips an unfinished chunk
+            results = pool.imap(_count_chunk, row_chunks)
+
+        try:
+            for i, chunk in enumerate(results, 1):
+                self.merge(chunk)
+                if i % checkpoint_every == 0:
+                    self.save()
+                    print(f"Checkpointed {self.games} games (last row {self.last_id})")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.save()
+        return self.games - before
+
+    def save(self):
+        """Write state, vocabulary and the readable results, each atomically"""
+        np = self.np
+        self.vocab.save(os.path.join(self.out_dir, VOCAB_FILE))
+
+        state = {}
+        formats = sorted(self.formats)
+        for i, fmt in enumerate(formats):
+            state.update(self.formats[fmt].to_state(f'{i}_'))
+        state_path = os.path.join(self.out_dir, STATE_FILE)
+        tmp_path = state_path + '.tmp.npz'
+        np.savez(tmp_path, version=STATE_VERSION, last_id=self.last_id,
+                 formats=np.asarray(formats, dtype=str), **state)
+        os.replace(tmp_path, state_path)
+
+        results_path = os.path.join(self.out_dir, RESULTS_FILE)
+        with open(results_path + '.tmp', 'w') as f:
+            json.dump(self.results(), f, indent=2)
+        os.replace(results_path + '.tmp', results_path)
+
+    def results(self, top: int = 50) -> Dict:
+        """Readable summary per format of the top entries for each statistic"""
+        return {
+            'games': self.games,
+            'last_row_id': self.last_id,
+            'formats': {fmt: totals.results(self.vocab, top) for fmt, totals in sorted(self.formats.items())},
+        }
+
+def chunk_rows(rows: Iterable[Tuple[int, str, Optional[float]]], chunk_size: int) -> Iterator[List]:
+    """Group rows into lists of chunk_size"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def main():
+    parser = argparse.ArgumentParser(description="Update replay corpus analytics from the database")
+    parser.add_argument('out_dir', help="directory holding analytics state and results.json")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    try:
+        from .db import getConnection, fetchReplayRows
+    except ImportError:
+        from db import getConnection, fetchReplayRows
+
+    analytics = CorpusAnalytics(args.out_dir)
+    cursor, _ = getConnection()
+    rows = fetchReplayRows(cursor, after_id=analytics.last_id)
+    added = analytics.update(chunk_rows(rows, args.chunk_size), workers=args.workers)
+    print(f"Added {added} games, {analytics.games} total across {len(analytics.formats)} formats")
+    # New species and moves were interned into the shared vocabulary on a fresh directory
+    save_vocabulary()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import hashlib
+import math
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from .PS_vocab import get_vocabulary
+except ImportError:
+    from PS_vocab import get_vocabulary
+
+# Rule settings; pass overrides to ReplayFilter(rules=...). A falsy value disables a rule.
+DEFAULT_RULES = {
+    'missing_players': True,  # Replay doesn't have exactly two named players
+    'no_winner': True,        # No |win| line (abandoned or truncated upload)
+    'min_turns': 3,           # Fewer turns than this were played
+    'early_forfeit': 5,       # Someone forfeited or timed out before this turn
+}
+
+# Message types that make up the normalised turn sequence used for fingerprints
+FINGERPRINT_TYPES = frozenset(['move', 'switch', 'drag', 'faint', 'win'])
+
+# -message suffixes that mean a player left the game rather than losing it
+FORFEIT_SUFFIXES = (' forfeited.', ' lost due to inactivity.')
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 128-bit replay fingerprints"""
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, fingerprint: str) -> Iterator[int]:
+        # Double hashing: both halves of the fingerprint seed the k probes
+        h1 = int(fingerprint[:16], 16)
+        h2 = int(fingerprint[16:32], 16) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, fingerprint: str):
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+def _turn_items(cleaned_replay: Dict):
+    """Turns sorted by number (keys are strings once a replay has been through JSON)"""
+    return sorted(cleaned_replay.get('turns', {}).items(), key=lambda item: int(item[0]))
+
+def fingerprint_replay(cleaned_replay: Dict) -> str:
+    """
+    Fingerprint a cleaned replay by hashing its teams and normalised turn sequence
+
+    Ids, timestamps, chat, HP values and nicknames don't take part, so the same
+    game saved under different ids hashes identically.
+
+    Returns:
+        32 character hex digest
+    """
+    vocab = get_vocabulary()
+    digest = hashlib.blake2b(digest_size=16)
+
+    teams = {'p1': [], 'p2': []}
+    for line in cleaned_replay.get('pre_battle', []):
+        if line.startswith('|poke|'):
+            parts = line.split('|')
+            if len(parts) > 3 and parts[2] in teams:
+                teams[parts[2]].append(vocab.species_from_info(parts[3]))
+    for side in ('p1', 'p2'):
+        digest.update(('|'.join(sorted(teams[side])) + '\n').encode())
+
+    for turn_num, turn_actions in _turn_items(cleaned_replay):
+        digest.update(f'#{turn_num}\n'.encode())
+        for line in turn_actions:
+            parts = line.split('|')
+            if len(parts) < 3 or parts[1] not in FINGERPRINT_TYPES:
+                continue
+            if parts[1] == 'win':
+                event = f'win|{parts[2]}'
+            else:
+                # Keep the side and the move/species, drop nicknames and HP
+                detail = parts[3] if len(parts) > 3 else ''
+                if parts[1] != 'move':
+                    detail = vocab.species_from_info(detail)
+                event = f'{parts[1]}|{parts[2][:2]}|{detail}'
+            digest.update(event.encode() + b'\n')
+
+    return digest.hexdigest()
+
+def check_rules(cleaned_replay: Dict, rules: Dict) -> List[str]:
+    """Return the names of the rules a cleaned replay breaks"""
+    broken = []
+    turns = _turn_items(cleaned_replay)
+
+    if rules.get('missing_players'):
+        players = cleaned_replay.get('players', [])
+        if len(players) != 2 or not all(players):
+            broken.append('missing_players')
+
+    has_winner = False
+    forfeit_turn = None
+    for turn_num, turn_actions in turns:
+        for line in turn_actions:
+            if line.startswith('|win|'):
+                has_winner = True
+            elif forfeit_turn is None and line.startswith('|-message|') and line.endswith(FORFEIT_SUFFIXES):
+                forfeit_turn = int(turn_num)
+
+    if rules.get('no_winner') and not has_winner:
+        broken.append('no_winner')
+
+    last_turn = int(turns[-1][0]) if turns else 0
+    if rules.get('min_turns') and last_turn < rules['min_turns']:
+        broken.append('min_turns')
+
+    if rules.get('early_forfeit') and forfeit_turn is not None and forfeit_turn < rules['early_forfeit']:
+        broken.append('early_forfeit')
+
+    return broken
+
+class ReplayFilter:
+    """
+    Drop duplicate and incomplete replays before they get converted
+
+    Duplicates are found through an in-memory Bloom filter of fingerprints. When a
+    database cursor is given, the filter is seeded from the fingerprints table and
+    Bloom hits are confirmed against it, so false positives don't drop games.
+
+    Checking and recording are separate steps: accept() only decides, and a kept
+    replay is recorded as seen with mark_seen() once it has actually been stored.
+    A replay whose store failed is handed to release() (or simply never marked),
+    so a later run retries it instead of dropping it as a duplicate. Fingerprints
+    and tags are kept here, not written into the replay dict; callers store them
+    next to the row (see fingerprint_of and tags_of).
+    """
+
+    def __init__(self, rules: Optional[Dict] = None, tag_only: Iterable[str] = (),
+                 capacity: int = 1_000_000, error_rate: float = 0.001, cursor=None, conn=None):
+        """
+        Args:
+            rules: Overrides for DEFAULT_RULES
+            tag_only: Rule names that only tag replays (see tags_of) instead of dropping them
+            capacity: Expected number of distinct replays, sizes the Bloom filter
+            error_rate: Target Bloom filter false positive rate
+            cursor, conn: Optional database connection backing the fingerprints
+        """
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.tag_only = set(tag_only)
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.cursor = cursor
+        self.conn = conn
+        self.stats = Counter()
+        # Accepted but not yet stored: replay id -> (fingerprint, tags)
+        self._pending = {}
+        self._pending_fingerprints = set()
+
+        if cursor is not None:
+            for fingerprint in self._db().fetchFingerprints(cursor):
+                self.bloom.add(fingerprint)
+
+    def _db(self):
+        try:
+            from . import db
+        except ImportError:
+            import db
+        return db
+
+    def _is_duplicate(self, fingerprint: str) -> bool:
+        # Catches copies within the batch that is still being stored
+        if fingerprint in self._pending_fingerprints:
+            return True
+        if fingerprint not in self.bloom:
+            return False
+        if self.cursor is None:
+            return True
+        return self._db().fingerprintExists(self.cursor, fingerprint)
+
+    def accept(self, cleaned_replay: Dict) -> bool:
+        """Check one cleaned replay; a kept one stays pending until mark_seen()"""
+        self.stats['seen'] += 1
+
+        broken = check_rules(cleaned_replay, self.rules)
+        dropping = [rule for rule in broken if rule not in self.tag_only]
+        if dropping:
+            self.stats['dropped'] += 1
+            self.stats.update(dropping)
+            return False
+
+        fingerprint = fingerprint_replay(cleaned_replay)
+        if self._is_duplicate(fingerprint):
+            self.stats['dropped'] += 1
+            self.stats['duplicate'] += 1
+            return False
+
+        tags = [rule for rule in broken if rule in self.tag_only]
+        self.stats.update(f'tagged_{rule}' for rule in tags)
+        self._pending[cleaned_replay.get('id', '')] = (fingerprint, tags)
+        self._pending_fingerprints.add(fingerprint)
+        self.stats['kept'] += 1
+        return True
+
+    def filter(self, cleaned_replays: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield only the replays that pass, e.g. in front of convert_many"""
+        for cleaned_replay in cleaned_replays:
+            if cleaned_replay and self.accept(cleaned_replay):
+                yield cleaned_replay
+
+    def fingerprint_of(self, cleaned_replay: Dict) -> str:
+        """Fingerprint of an accepted replay, for storing alongside its row"""
+        pending = self._pending.get(cleaned_replay.get('id', ''))
+        return pending[0] if pending else fingerprint_replay(cleaned_replay)
+
+    def fingerprint_rows(self, cleaned_replays: Iterable[Dict]) -> List[Tuple[str, str]]:
+        """(fingerprint, game_id) rows for insertJSON/insertManyJSON"""
+        return [(self.fingerprint_of(replay), replay.get('id', '')) for replay in cleaned_replays]
+
+    def tags_of(self, cleaned_replay: Dict) -> List[str]:
+        """tag_only rules an accepted replay broke, for the tags column; read before mark_seen()"""
+        pending = self._pending.get(cleaned_replay.get('id', ''))
+        return list(pending[1]) if pending else []
+
+    def mark_seen(self, cleaned_replays: Iterable[Dict]):
+        """
+        Record stored replays so later copies are dropped
+
+        Only updates the in-memory filter; the fingerprints table is written by
+        the caller in the same transaction as the rows (see fingerprint_rows).
+        """
+        for cleaned_replay in cleaned_replays:
+            fingerprint, _ = self._pending.pop(cleaned_replay.get('id', ''), (None, None))
+            if fingerprint is None:
+                fingerprint = fingerprint_replay(cleaned_replay)
+            self._pending_fingerprints.discard(fingerprint)
+            self.bloom.add(fingerprint)
+
+    def release(self, cleaned_replays: Iterable[Dict]):
+        """Forget accepted replays that were not stored, so they can be retried"""
+        for cleaned_replay in cleaned_replays:
+            pending = self._pending.pop(cleaned_replay.get('id', ''), None)
+            if pending is not None:
+                self._pending_fingerprints.discard(pending[0])
+
+    def report(self) -> Dict[str, int]:
+        """Counts of seen/kept/dropped replays and of drops per rule"""
+        return dict(self.stats)
@@ -0,0 +1,228 @@
+"""
+Local stand-in for replay.pokemonshowdown.com, served from a fixture corpus
+
+Serves search.json pages and <id>.json replays the way the live site does, so the
+scraper, cleaner and the rest of the pipeline can be load-tested or debugged with
+no network. Latency, server errors and 429 rate limiting can be injected.
+
+The fixture directory holds raw replay JSON files named <id>.json. With
+replicate > 1 each fixture is also served under that many consecutive ids
+(gen9ou-2497246974, gen9ou-2497246975, ...) to build a corpus of any size.
+
+Usage:
+    python data/PS_fixture_server.py --port 8765 --replicate 200 --latency 0.05
+    PS_REPLAY_BASE_URL=http://127.0.0.1:8765 python data/main.py
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'replays')
+
+# The live search returns 50 replays a page, plus one extra when another page exists
+PAGE_SIZE = 50
+
+class FixtureCorpus:
+    """Raw replays from a fixture directory, optionally replicated under new ids"""
+
+    def __init__(self, fixture_dir=DEFAULT_FIXTURE_DIR, replicate=1):
+        self.replays = {}
+        self.entries = []
+        for path in sorted(glob.glob(os.path.join(fixture_dir, '*.json'))):
+            with open(path) as f:
+                replay = json.load(f)
+            base_id = replay['id']
+            prefix, _, number = base_id.rpartition('-')
+            for copy in range(replicate):
+                replay_id = f"{prefix}-{int(number) + copy}" if copy else base_id
+                self.replays[replay_id] = (replay, copy)
+                self.entries.append({
+                    'uploadtime': replay.get('uploadtime', 0) + copy,
+                    'id': replay_id,
+                    'format': replay.get('format', ''),
+                    'formatid': replay.get('formatid', prefix),
+                    'players': replay.get('players', []),
+                    'rating': replay.get('rating'),
+                    'private': 0,
+                    'password': None,
+                })
+        # Newest first, like the live search
+        self.entries.sort(key=lambda entry: entry['uploadtime'], reverse=True)
+
+        if not self.replays:
+            raise ValueError(f"No fixture replays found in {fixture_dir}")
+
+    def search(self, format_id=None, page=1):
+        """One page of search results, with a 51st entry when more pages follow"""
+        entries = [entry for entry in self.entries if not format_id or entry['formatid'] == format_id]
+        start = (page - 1) * PAGE_SIZE
+        return entries[start:start + PAGE_SIZE + 1]
+
+    def replay(self, replay_id):
+        """Raw replay JSON for replay_id, or None if there isn't one"""
+        found = self.replays.get(replay_id)
+        if found is None:
+            return None
+        replay, copy = found
+        if copy:
+            replay = dict(replay, id=replay_id, uploadtime=replay.get('uploadtime', 0) + copy)
+        return replay
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Routes /search.json and /<id>.json, injecting faults configured on the server"""
+
+    server_version = 'PSFixtureServer/1.0'
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + server.jitter * server.roll())
+        if server.roll() < server.throttle_rate:
+            server.count('throttled')
+            self._send(429, {'error': 'Too many requests'}, {'Retry-After': str(server.retry_after)})
+            return
+        if server.roll() < server.error_rate:
+            server.count('errors')
+            self._send(500, {'error': 'Internal server error'})
+            return
+
+        url = urlsplit(self.path)
+        path = url.path.lstrip('/')
+        if path == 'search.json':
+            query = parse_qs(url.query)
+            try:
+                page = int(query.get('page', ['1'])[0])
+            except ValueError:
+                page = 1
+            self._send(200, server.corpus.search(query.get('format', [None])[0], max(page, 1)))
+        elif path.endswith('.json'):
+            replay = server.corpus.replay(path[:-len('.json')])
+            if replay is None:
+                self._send(404, {'error': 'Not found'})
+            else:
+                server.count('replays')
+                self._send(200, replay)
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server over a FixtureCorpus
+
+    Args:
+        fixture_dir: Directory of raw replay JSON fixtures
+        host, port: Address to bind; port 0 picks a free port (see .url)
+        latency: Seconds added to every response
+        jitter: Up to this many extra seconds, drawn uniformly per response
+        error_rate: Fraction of requests answered with a 500
+        throttle_rate: Fraction of requests answered with a 429
+        retry_after: Retry-After seconds sent with each 429
+        replicate: Ids each fixture is served under
+        seed: Seed for fault injection, for reproducible runs
+        verbose: Log each request to stderr
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixture_dir=DEFAULT_FIXTURE_DIR, host='127.0.0.1', port=0, latency=0.0,
+                 jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, replicate=1,
+                 seed=None, verbose=False):
+        self.corpus = FixtureCorpus(fixture_dir, replicate)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.stats = {'requests': 0, 'replays': 0, 'errors': 0, 'throttled': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        super().__init__((host, port), FixtureHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def start(self):
+        """Serve from a background thread; returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve replay fixtures in place of replay.pokemonshowdown.com")
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURE_DIR, help="directory of raw replay JSON files")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--replicate', type=int, default=1, help="ids each fixture is served under")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = FixtureServer(
+        args.fixtures, args.host, args.port, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        replicate=args.replicate, seed=args.seed, verbose=args.verbose,
+    )
+    print(f"Serving {len(server.corpus.replays)} replays at {server.url}")
+    print(f"Point the pipeline at it with PS_REPLAY_BASE_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stopped: {server.stats}")
+
+if __name__ == "__main__":
+    main()
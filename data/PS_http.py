@@ -0,0 +1,187 @@
+"""
+HTTP access to the replay site, with a swappable base URL and transport
+
+The scraper and cleaner fetch through get() here instead of calling requests
+directly, so the whole pipeline can be pointed at the local fixture server
+(PS_fixture_server.py) or run from recorded responses with no network at all.
+
+Environment:
+    PS_REPLAY_BASE_URL: Replay site root (default https://replay.pokemonshowdown.com)
+    PS_HTTP_MODE: 'live' (default), 'record' or 'replay'
+    PS_HTTP_CASSETTES: Directory of recorded responses for record/replay modes
+"""
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_BASE_URL = 'https://replay.pokemonshowdown.com'
+DEFAULT_CASSETTE_DIR = 'cassettes'
+
+# Longest single sleep between 429 retries, whatever Retry-After and the backoff say
+MAX_RETRY_WAIT = 30.0
+
+_base_url = os.environ.get('PS_REPLAY_BASE_URL', DEFAULT_BASE_URL).rstrip('/')
+_transport = None
+
+def set_base_url(url):
+    """Point replay_url() (and so the scraper and cleaner) at another replay site root"""
+    global _base_url
+    _base_url = url.rstrip('/')
+
+def get_base_url():
+    return _base_url
+
+def replay_url(path):
+    """
+    Build a URL on the current replay site
+
+    Args:
+        path: Path below the site root, e.g. 'search.json?format=gen9ou' or '<id>.json'
+    """
+    return f"{_base_url}/{path.lstrip('/')}"
+
+class RecordedResponse:
+    """
+    The parts of requests.Response the pipeline uses, backed by a stored body
+    """
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LiveTransport:
+    """Plain requests session; requests is imported on the first request"""
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._session = None
+
+    def get(self, url, stream=False):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session.get(url, stream=stream, timeout=self.timeout)
+
+def _cassette_path(cassette_dir, url):
+    return os.path.join(cassette_dir, hashlib.sha1(url.encode()).hexdigest()[:20] + '.json')
+
+class RecordingTransport:
+    """
+    Fetches through another transport and saves every response it sees
+
+    A URL fetched more than once keeps its latest response, so a 429 that was
+    retried is recorded as the response that finally succeeded.
+    """
+
+    def __init__(self, cassette_dir=DEFAULT_CASSETTE_DIR, inner=None):
+        self.cassette_dir = cassette_dir
+        self.inner = inner or LiveTransport()
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    def get(self, url, stream=False):
+        response = self.inner.get(url)
+        recorded = RecordedResponse(url, response.status_code, {
+            key: value for key, value in response.headers.items()
+            if key.lower() in ('content-type', 'retry-after')
+        }, response.content)
+
+        path = _cassette_path(self.cassette_dir, url)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'url': url,
+                'status': recorded.status_code,
+                'headers': recorded.headers,
+                'body': recorded.text,
+            }, f)
+        os.replace(tmp_path, path)
+        return recorded
+
+class ReplayTransport:
+    """Serves responses saved by RecordingTransport without touching the network"""
+
+    def __init__(self, cassette_dir=DEFAULT_CASSETTE_DIR):
+        self.cassette_dir = cassette_dir
+
+    def get(self, url, stream=False):
+        path = _cassette_path(self.cassette_dir, url)
+        if not os.path.exists(path):
+            import requests
+            raise requests.ConnectionError(f"No recorded response for {url} in {self.cassette_dir}")
+        with open(path) as f:
+            cassette = json.load(f)
+        return RecordedResponse(url, cassette['status'], cassette['headers'], cassette['body'].encode('utf-8'))
+
+def set_transport(transport):
+    """Use transport (anything with get(url, stream)) for all later requests"""
+    global _transport
+    _transport = transport
+
+def get_transport():
+    """Current transport, built from PS_HTTP_MODE/PS_HTTP_CASSETTES on first use"""
+    global _transport
+    if _transport is None:
+        mode = os.environ.get('PS_HTTP_MODE', 'live')
+        cassette_dir = os.environ.get('PS_HTTP_CASSETTES', DEFAULT_CASSETTE_DIR)
+        if mode == 'record':
+            _transport = RecordingTransport(cassette_dir)
+        elif mode == 'replay':
+            _transport = ReplayTransport(cassette_dir)
+        elif mode == 'live':
+            _transport = LiveTransport()
+        else:
+            raise ValueError(f"Unknown PS_HTTP_MODE {mode!r}, expected live, record or replay")
+    return _transport
+
+def get(url, stream=False, retries=3):
+    """
+    GET url through the current transport, waiting out 429 rate limits
+
+    Args:
+        url: URL to fetch
+        stream: Leave the body unread so it can be consumed with iter_content
+        retries: How many 429 responses to retry before returning one
+    Returns:
+        A requests.Response, or a RecordedResponse in record/replay modes
+    """
+    transport = get_transport()
+    for attempt in range(retries + 1):
+        response = transport.get(url, stream=stream)
+        if response.status_code != 429 or attempt == retries:
+            return response
+        try:
+            wait = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            wait = 1.0
+        response.close()
+        # Back off harder on repeated 429s, but never past MAX_RETRY_WAIT
+        time.sleep(min(max(wait, 0.0) * (attempt + 1), MAX_RETRY_WAIT))
+    return response
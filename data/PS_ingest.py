@@ -0,0 +1,393 @@
+"""
+Stream raw replay JSONL into the clean -> filter -> convert -> store path
+
+Each input line is one raw replay as served by replay.pokemonshowdown.com/<id>.json.
+Input can be a file, a directory of *.jsonl files being appended to, or stdin ('-').
+Lines are processed in bounded micro-batches. Replays, their fingerprints and
+trajectories are made durable together (every batch, or once a full shard is
+buffered when writing shards), and only then is the byte offset reached in each
+file committed, so a restart resumes where it stopped without losing replays.
+
+Usage:
+    python data/PS_ingest.py dumps/ --follow --store --shards shards/
+    cat replays.jsonl | python data/PS_ingest.py -
+"""
+import argparse
+import glob
+import json
+import os
+import select
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .PS_json_cleaner import clean_replay_data
+    from .PS_filter import DEFAULT_RULES, ReplayFilter
+    from .POVConverter import convert_inline, convert_many, create_converter, create_pool
+    from .PS_vocab import save_vocabulary
+except ImportError:
+    from PS_json_cleaner import clean_replay_data
+    from PS_filter import DEFAULT_RULES, ReplayFilter
+    from POVConverter import convert_inline, convert_many, create_converter, create_pool
+    from PS_vocab import save_vocabulary
+
+STDIN = '-'
+
+class OffsetStore:
+    """Committed byte offset per input file, persisted as JSON"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.offsets = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.offsets = json.load(f)
+
+    def get(self, source: str) -> int:
+        return self.offsets.get(source, 0)
+
+    def commit(self, offsets: Dict[str, int]):
+        """Record new offsets and write them out atomically"""
+        if not offsets:
+            return
+        self.offsets.update(offsets)
+        if self.path:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.offsets, f)
+            os.replace(tmp_path, self.path)
+
+class JsonlSource:
+    """
+    Non-blocking reader of complete JSONL lines from a file, directory or stdin
+
+    read() returns whatever complete lines are available right now as
+    (source, end_offset, line) tuples; end_offset is None for stdin. finished is
+    set once nothing more will arrive: stdin hit EOF, or files ran dry without follow.
+    """
+
+    def __init__(self, source: str, offsets: OffsetStore, follow: bool = False):
+        self.source = source
+        self.follow = follow
+        self.finished = False
+        self._eof = False
+        self._positions = {}
+        self._handles = {}
+        self._offsets = offsets
+        self._stdin_buffer = b''
+
+    def _files(self) -> List[str]:
+        if os.path.isdir(self.source):
+            return sorted(glob.glob(os.path.join(self.source, '*.jsonl')))
+        return [self.source]
+
+    def read(self, max_lines: int) -> List[Tuple[str, Optional[int], bytes]]:
+        if self.source == STDIN:
+            return self._read_stdin(max_lines)
+
+        lines = []
+        for path in self._files():
+            if len(lines) >= max_lines:
+                break
+            lines.extend(self._read_file(path, max_lines - len(lines)))
+        self.finished = not lines and not self.follow
+        return lines
+
+    def _read_file(self, path: str, max_lines: int):
+        position = self._positions.get(path)
+        if position is None:
+            position = self._offsets.get(path)
+        try:
+            if os.path.getsize(path) < position:
+                # File was truncated or replaced; start it over
+                print(f"{path} shrank below offset {position}, restarting it")
+                position = 0
+                self._handles.pop(path, None)
+        except OSError:
+            return []
+
+        handle = self._handles.get(path)
+        if handle is None:
+            handle = self._handles[path] = open(path, 'rb')
+        handle.seek(position)
+
+        lines = []
+        while len(lines) < max_lines:
+            line = handle.readline()
+            if not line:
+                break
+            if not line.endswith(b'\n') and self.follow:
+                # Writer hasn't finished this line yet
+                break
+            position += len(line)
+            if line.strip():
+                lines.append((path, position, line))
+        self._positions[path] = position
+        return lines
+
+    def _read_stdin(self, max_lines: int):
+        fd = sys.stdin.fileno()
+        lines = []
+        while len(lines) < max_lines:
+            newline = self._stdin_buffer.find(b'\n')
+            if newline >= 0:
+                line, self._stdin_buffer = self._stdin_buffer[:newline + 1], self._stdin_buffer[newline + 1:]
+                if line.strip():
+                    lines.append((STDIN, None, line))
+                continue
+            if self._eof or not select.select([fd], [], [], 0)[0]:
+                break
+            chunk = os.read(fd, 1 << 20)
+            if not chunk:
+                self._eof = True
+                if self._stdin_buffer.strip():
+                    lines.append((STDIN, None, self._stdin_buffer))
+                self._stdin_buffer = b''
+                break
+            self._stdin_buffer += chunk
+        self.finished = self._eof and not lines
+        return lines
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+
+class Ingestor:
+    """
+    Runs micro-batches through cleaning, filtering, conversion and storage
+
+    Converted batches are held until a commit point: every batch without shards,
+    otherwise once a full shard's worth of steps is buffered. At that point the
+    shard is written first, then the replays and their fingerprints are stored in
+    one transaction and marked seen. A crash before that re-reads the batches
+    instead of dropping them as duplicates.
+    """
+
+    def __init__(self, workers: Optional[int] = None, store: bool = False,
+                 shards_dir: Optional[str] = None, use_filter: bool = True,
+                 priors_path: Optional[str] = None, shard_size: int = 65536,
+                 tag_only: Iterable[str] = ()):
+        self.workers = workers or os.cpu_count() or 1
+        # One converter (and one copy of the priors) for the life of the ingestor
+        if self.workers > 1:
+            self.pool = create_pool(self.workers, priors_path)
+            self.converter = None
+        else:
+            self.pool = None
+            self.converter = create_converter(priors_path)
+        self.cursor = self.conn = None
+        self.writer = None
+        self.stats = {'lines': 0, 'bad_lines': 0, 'stored': 0, 'converted': 0, 'failed': 0}
+        # Replays converted since the last commit point
+        self._uncommitted = []
+
+        if store:
+            try:
+                from .db import getConnection, createTable, createFingerprintTable
+            except ImportError:
+                from db import getConnection, createTable, createFingerprintTable
+            self.cursor, self.conn = getConnection()
+            createTable(self.cursor)
+            createFingerprintTable(self.cursor)
+
+        self.replay_filter = None
+        if use_filter:
+            self.replay_filter = ReplayFilter(tag_only=tag_only, cursor=self.cursor, conn=self.conn)
+
+        if shards_dir:
+            try:
+                from .PS_trajectories import TrajectoryShardWriter
+            except ImportError:
+                from PS_trajectories import TrajectoryShardWriter
+            self.writer = TrajectoryShardWriter(shards_dir, shard_size, auto_write=False)
+
+    def process(self, batch: List[Tuple[str, Optional[int], bytes]]) -> bool:
+        """
+        Clean, filter and convert one micro-batch
+
+        The batch joins the uncommitted replays (and the shard buffer) only once
+        all of it has converted. If conversion is interrupted the batch is released
+        from the filter and its buffered steps dropped, so close() never commits a
+        batch whose offsets the caller hasn't recorded.
+
+        Returns:
+            True if a commit point has been reached and commit() should be called
+        """
+        cleaned = []
+        for _, _, line in batch:
+            self.stats['lines'] += 1
+            try:
+                cleaned.append(clean_replay_data(json.loads(line)))
+            except (ValueError, AttributeError) as e:
+                self.stats['bad_lines'] += 1
+                print(f"Skipping unreadable line: {e}")
+
+        checkpoint = self.writer.checkpoint() if self.writer is not None else None
+        try:
+            if self.replay_filter is not None:
+                cleaned = list(self.replay_filter.filter(cleaned))
+
+            if self.pool is None:
+                results = list(convert_inline(self.converter, cleaned))
+            else:
+                # A few chunks per worker keeps them all busy without per-replay IPC
+                chunksize = max(1, len(cleaned) // (4 * self.workers))
+                results = list(convert_many(cleaned, chunksize=chunksize, pool=self.pool))
+
+            if self.writer is not None:
+                for _, perspectives in results:
+                    if perspectives is not None:
+                        for perspective in perspectives.values():
+                            self.writer.add(perspective)
+        except BaseException:
+            if self.writer is not None:
+                self.writer.rollback(checkpoint)
+            if self.replay_filter is not None:
+                # Only this batch's replays; earlier uncommitted ones stay pending
+                committed_ids = {replay.get('id', '') for replay in self._uncommitted}
+                self.replay_filter.release(replay for replay in cleaned
+                                           if replay and replay.get('id', '') not in committed_ids)
+            raise
+
+        self._uncommitted.extend(cleaned)
+        for _, perspectives in results:
+            self.stats['failed' if perspectives is None else 'converted'] += 1
+
+        return self.writer is None or self.writer.buffered_rows >= self.writer.shard_size
+
+    def commit(self):
+        """Make everything converted so far durable: shard, then rows and fingerprints"""
+        # Shards go first: if storing fails after this the batches are re-read and
+        # written again, rather than stored, marked seen and missing from the shards
+        if self.writer is not None and self.writer.buffered_rows:
+            self.writer.flush()
+
+        replays = self._uncommitted
+        if self.cursor is not None and replays:
+            try:
+                from .db import insertManyJSON
+            except ImportError:
+                from db import insertManyJSON
+            fingerprints, tags = (), None
+            if self.replay_filter is not None:
+                fingerprints = self.replay_filter.fingerprint_rows(replays)
+                tags = [self.replay_filter.tags_of(replay) for replay in replays]
+            self.stats['stored'] += insertManyJSON(self.cursor, self.conn, replays, fingerprints, tags)
+
+        if self.replay_filter is not None:
+            self.replay_filter.mark_seen(replays)
+        self._uncommitted = []
+
+    def close(self):
+        """Commit whatever is still buffered, then stop the workers"""
+        try:
+            self.commit()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+            if self.writer is not None:
+                self.writer.close()
+
+def ingest(source: str, offsets_path: Optional[str] = None, follow: bool = False,
+           batch_size: int = 500, max_wait: float = 1.0, poll_interval: float = 0.2,
+           **ingestor_options) -> Dict[str, int]:
+    """
+    Ingest a JSONL stream of raw replays in micro-batches
+
+    Args:
+        source: JSONL file, directory of *.jsonl files, or '-' for stdin
+        offsets_path: File holding committed offsets (stdin is never resumed)
+        follow: Keep waiting for appended lines/files instead of stopping at EOF
+        batch_size: Maximum replays per micro-batch
+        max_wait: Seconds a partial batch may wait for more lines before it is processed
+        poll_interval: Seconds to sleep when no new lines are available
+        ingestor_options: workers, store, shards_dir, use_filter, priors_path, shard_size,
+            tag_only (see Ingestor)
+
+    Returns:
+        Counts of lines read, stored, converted and failed, plus filter results
+    """
+    offsets = OffsetStore(offsets_path)
+    reader = JsonlSource(source, offsets, follow)
+    ingestor = Ingestor(**ingestor_options)
+    started = time.monotonic()
+
+    batch = []
+    deadline = None
+    # Offsets of processed batches that haven't reached a commit point yet
+    pending_offsets = {}
+    try:
+        while True:
+            lines = reader.read(batch_size - len(batch))
+            if lines and not batch:
+                deadline = time.monotonic() + max_wait
+            batch.extend(lines)
+
+            if batch and (len(batch) >= batch_size or reader.finished or time.monotonic() >= deadline):
+                ready = ingestor.process(batch)
+                # The batch is now part of what the next commit (or close()) stores
+                pending_offsets.update({path: end for path, end, _ in batch if end is not None})
+                if ready:
+                    ingestor.commit()
+                    offsets.commit(pending_offsets)
+                    pending_offsets = {}
+                elapsed = time.monotonic() - started
+                print(f"Processed {ingestor.stats['lines']} replays "
+                      f"({ingestor.stats['lines'] / max(elapsed, 1e-9):.1f}/s)")
+                batch = []
+            elif reader.finished:
+                break
+            elif not lines:
+                wait = poll_interval if not batch else min(poll_interval, max(0.0, deadline - time.monotonic()))
+                time.sleep(wait)
+    except KeyboardInterrupt:
+        print("Stopping; uncommitted lines will be read again on restart")
+    finally:
+        reader.close()
+        # Only reached without an exception from close(), so the batches are durable
+        ingestor.close()
+        offsets.commit(pending_offsets)
+        save_vocabulary()
+
+    stats = dict(ingestor.stats)
+    if ingestor.replay_filter is not None:
+        stats['filter'] = ingestor.replay_filter.report()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest raw replay JSONL into the data pipeline")
+    parser.add_argument('source', help="JSONL file, directory of *.jsonl files, or '-' for stdin")
+    parser.add_argument('--offsets', default=None,
+                        help="offsets file (default: <source>.offsets.json for files/directories)")
+    parser.add_argument('--follow', action='store_true', help="keep reading as the source grows")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-wait', type=float, default=1.0,
+                        help="seconds a partial batch waits for more lines")
+    parser.add_argument('--workers', type=int, default=None, help="converter processes (1 = inline)")
+    parser.add_argument('--store', action='store_true', help="insert cleaned replays into the database")
+    parser.add_argument('--shards', default=None, help="directory for trajectory .npz shards")
+    parser.add_argument('--shard-size', type=int, default=65536,
+                        help="steps per shard; offsets are committed as each shard is written")
+    parser.add_argument('--no-filter', action='store_true', help="skip duplicate/incomplete filtering")
+    parser.add_argument('--tag-only', nargs='*', default=[], choices=sorted(DEFAULT_RULES),
+                        help="filter rules that tag replays (stored in the tags column) instead of dropping them")
+    parser.add_argument('--priors', default=None, help="usage priors for hidden-information reconstruction")
+    args = parser.parse_args()
+
+    offsets_path = args.offsets
+    if offsets_path is None and args.source != STDIN:
+        offsets_path = args.source.rstrip(os.sep) + '.offsets.json'
+
+    stats = ingest(
+        args.source, offsets_path, follow=args.follow, batch_size=args.batch_size,
+        max_wait=args.max_wait, workers=args.workers, store=args.store,
+        shards_dir=args.shards, shard_size=args.shard_size, use_filter=not args.no_filter,
+        priors_path=args.priors, tag_only=args.tag_only,
+    )
+    print(f"Ingest complete: {stats}")
+
+if __name__ == "__main__":
+    main()
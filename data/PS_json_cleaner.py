@@ -1,7 +1,15 @@
+import codecs
+import itertools
 import json
 import re
 import sys
-import requests
+
+try:
+    from .PS_vocab import get_vocabulary
+    from .PS_http import get
+except ImportError:
+    from PS_vocab import get_vocabulary
+    from PS_http import get
 
 def clean_showdown_replay(url):
     """
@@ -15,23 +23,11 @@ def clean_showdown_replay(url):
     # Download the JSON
     print(f"Downloading from: {url}")
     try:
-        response = requests.get(url)
+        response = get(url)
         response.raise_for_status()
         replay_data = response.json()
 
-        # Extract basic info
-        cleaned_data = {
-            'id': replay_data.get('id', ''),
-            'format': replay_data.get('format', ''),
-            'players': replay_data.get('players', []),
-        }
-
-        # Clean the log if it exists
-        if 'log' in replay_data:
-            # Clean and format the log
-            clean_log = clean_battle_log(replay_data['log'])
-            turn_data = format_as_turns(clean_log)
-            cleaned_data.update(turn_data)
+        cleaned_data = clean_replay_data(replay_data)
 
         print(f"Successfully cleaned replay {cleaned_data['id']}")
         return cleaned_data
@@ -40,139 +36,396 @@ def clean_showdown_replay(url):
         print(f"Error: {e}")
         return None
 
-def clean_battle_log(log):
-    """Clean the battle log by removing chat and timestamps"""
-    # Split the log into lines
-    lines = log.split('\n')
-
-    # Define what to keep
-    keep_patterns = [
-        r'^\|switch\|',          # Pokemon switches
-        r'^\|move\|',            # Move usage
-        r'^\|turn\|',            # Turn markers
-        r'^\|-damage\|',         # Damage dealt
-        r'^\|-heal\|',           # Healing
-        r'^\|-supereffective\|', # Super effective hits
-        r'^\|-resisted\|',       # Resisted hits
-        r'^\|-immune\|',         # Immunity
-        r'^\|faint\|',           # Fainting
-        r'^\|-status\|',         # Status conditions
-        r'^\|-ability\|',        # Ability activations
-        r'^\|-enditem\|',        # Items being consumed
-        r'^\|-item\|',           # Items being revealed
-        r'^\|start\|',           # Battle start
-        r'^\|player\|',          # Player information
-        r'^\|teamsize\|',        # Team size
-        r'^\|gen\|',             # Generation info
-        r'^\|tier\|',            # Tier/format info
-        r'^\|win\|',             # Winner info
-        r'^\|drag\|',            # Forced switches
-        r'^\|replace\|',         # Pokemon replacement
-        r'^\|-activate\|',       # Ability/move activations
-        r'^\|-weather\|',        # Weather changes
-        r'^\|-fieldstart\|',     # Field effects starting
-        r'^\|-fieldend\|',       # Field effects ending
-        r'^\|-sidestart\|',      # Side effects starting
-        r'^\|-sideend\|',        # Side effects ending
-        r'^\|-crit\|',           # Critical hits
-        r'^\|-miss\|',           # Missed moves
-        r'^\|-fail\|',           # Failed moves
-        r'^\|-prepare\|',        # Move preparation
-        r'^\|-boost\|',          # Stat boosts
-        r'^\|-unboost\|',        # Stat decreases
-        r'^\|-clearallboost\|',  # Clear all stat changes
-        r'^\|-mega\|',           # Mega evolutions
-        r'^\|-primal\|',         # Primal reversions
-        r'^\|poke\|',            # Pokemon in team
-        r'^\|-terastallize\|'    # Terastallizing
-    ]
-
-    # Define what to explicitly remove
-    remove_patterns = [
-        r'^\|t:\|',              # Timestamps
-        r'^\|c\|',               # Chat messages
-        r'^\|j\|',               # Join messages
-        r'^\|l\|',               # Leave messages
-        r'^\|upkeep\|',          # Upkeep messages
-        r'^\|\|',                # Empty pipes
-        r'^\|gametype\|',        # Game type (already in format)
-        r'^\|rated\|',           # Rated marker
-        r'^\|rule\|',            # Rules (already in format)
-        r'^\|inactive\|',        # Inactivity warnings
-        r'^\|inactiveoff\|',     # Inactivity timer off
-        r'^\|html\|',            # HTML messages
-        r'^\|raw\|',             # Raw HTML messages
-        r'^\|uhtml\|',           # User HTML
-        r'^\|uhtmlchange\|',     # User HTML changes
-        r'^\|clearpoke\|',       # Clear Pokemon
-        r'^\|request\|',         # Request data
-        r'^\|error\|',           # Error messages
-        r'^\|popup\|',           # Popup messages
-        r'^\|queryresponse\|',   # Query responses
-        r'^\|spectator\|',       # Spectator count
-        r'^\|clearpoke\|',       # Clear Pokemon
-        r'^\|choice\|'           # Choice information
-    ]
-
-    # Combine patterns
-    combined_keep = '|'.join(keep_patterns)
-    keep_pattern = re.compile(combined_keep)
-
-    combined_remove = '|'.join(remove_patterns)
-    remove_pattern = re.compile(combined_remove)
+def clean_replay_data(replay_data):
+    """
+    Clean an already-downloaded Pokemon Showdown replay
 
-    # Filter the lines
-    cleaned_lines = []
+    Args:
+        replay_data: Raw replay JSON as a dictionary
+    Returns:
+        Cleaned replay data as a dictionary
+    """
+    # Extract basic info
+    cleaned_data = {
+        'id': replay_data.get('id', ''),
+        'format': replay_data.get('format', ''),
+        'players': replay_data.get('players', []),
+    }
 
-    for line in lines:
-        # Skip empty lines
-        if not line:
-            continue
+    # Clean the log if it exists
+    if 'log' in replay_data:
+        # Clean and format the log
+        clean_log = clean_battle_log(replay_data['log'])
+        turn_data = format_as_turns(clean_log)
+        cleaned_data.update(turn_data)
 
-        # Skip lines that match remove patterns
-        if remove_pattern.match(line):
-            continue
+    return cleaned_data
+
+# Message types dropped from the log (timestamps, chat, lobby and UI noise).
+# Everything else starting with '|' is kept: switches, moves, damage, turn
+# markers, pre-battle info and any battle line we don't know about yet.
+REMOVE_TYPES = frozenset([
+    't:',            # Timestamps
+    'c',             # Chat messages
+    'j',             # Join messages
+    'l',             # Leave messages
+    'upkeep',        # Upkeep messages
+    '',              # Empty pipes
+    'gametype',      # Game type (already in format)
+    'rated',         # Rated marker
+    'rule',          # Rules (already in format)
+    'inactive',      # Inactivity warnings
+    'inactiveoff',   # Inactivity timer off
+    'html',          # HTML messages
+    'raw',           # Raw HTML messages
+    'uhtml',         # User HTML
+    'uhtmlchange',   # User HTML changes
+    'clearpoke',     # Clear Pokemon
+    'request',       # Request data
+    'error',         # Error messages
+    'popup',         # Popup messages
+    'queryresponse', # Query responses
+    'spectator',     # Spectator count
+    'choice',        # Choice information
+])
+
+# Message types that belong to pre-battle initialization
+PRE_BATTLE_PREFIXES = ('start', 'player', 'teamsize', 'gen', 'tier')
+
+TURN_PATTERN = re.compile(r'^\|turn\|(\d+)$')
+
+def _message_type(line, vocab):
+    """
+    Split a protocol line into (message type, has_args)
+
+    '|move|p1a: X|Tackle' -> ('move', True), '|upkeep' -> ('upkeep', False).
+    The type string is the shared interned copy from the vocabulary.
+    """
+    parts = line.split('|', 2)
+    msg_type = parts[1] if len(parts) > 1 else ''
+    return vocab.canonical('message_types', msg_type), len(parts) > 2
 
-        # Keep lines that match keep patterns
-        if keep_pattern.match(line):
-            cleaned_lines.append(line)
-        # Also include initialization lines that might not have a pipe prefix
-        elif line.startswith('|'):
-            # This catches other important battle logs that might not be in our patterns
-            cleaned_lines.append(line)
+def _keep_line(line, vocab):
+    """Whether a raw log line survives cleaning"""
+    # Skip empty lines and lines that aren't protocol messages
+    if not line or not line.startswith('|'):
+        return False
+
+    # Skip message types we never keep (these always carry arguments)
+    msg_type, has_args = _message_type(line, vocab)
+    return not (has_args and msg_type in REMOVE_TYPES)
+
+def clean_battle_log(log):
+    """Clean the battle log by removing chat and timestamps"""
+    vocab = get_vocabulary()
+
+    # Filter the lines
+    cleaned_lines = [line for line in log.split('\n') if _keep_line(line, vocab)]
 
     # Join the cleaned lines back into a log
     return '\n'.join(cleaned_lines)
 
-def format_as_turns(cleaned_log):
-    """Format the cleaned log as structured turn data"""
-    lines = cleaned_log.split('\n')
+def iter_log_turns(lines):
+    """
+    Group cleaned log lines into turns, yielding each turn as soon as it ends
 
-    # Initialize variables
-    turns = {}
-    current_turn = 0  # Start with initialization (turn 0)
+    Yields ('pre_battle', lines) and ('turn', (turn_number, lines)) events. The
+    pre-battle lines are yielded when the first turn starts; pre-battle messages
+    that show up later (e.g. trailing |player| lines) are yielded as extra
+    ('pre_battle', [line]) events. A turn number that repeats yields again and
+    belongs with the earlier lines for that turn.
+    """
+    vocab = get_vocabulary()
     pre_battle = []
+    current_turn = None  # Still in initialization until the first turn marker
+    turn_lines = []
 
-    # Process lines
     for line in lines:
+        msg_type, _ = _message_type(line, vocab)
+
         # Check if this is a turn marker
-        turn_match = re.match(r'^\|turn\|(\d+)$', line)
+        turn_match = TURN_PATTERN.match(line) if msg_type == 'turn' else None
         if turn_match:
+            if current_turn is None:
+                yield 'pre_battle', pre_battle
+                pre_battle = None
+            else:
+                yield 'turn', (current_turn, turn_lines)
             current_turn = int(turn_match.group(1))
-            if current_turn not in turns:
-                turns[current_turn] = []
-        elif line.startswith('|start') or line.startswith('|player') or line.startswith('|teamsize') or line.startswith('|gen') or line.startswith('|tier'):
+            turn_lines = []
+        elif msg_type.startswith(PRE_BATTLE_PREFIXES):
             # These are pre-battle initialization
-            pre_battle.append(line)
-        elif current_turn in turns:
+            if current_turn is None:
+                pre_battle.append(line)
+            else:
+                yield 'pre_battle', [line]
+        elif current_turn is not None:
             # Add this line to the current turn
-            turns[current_turn].append(line)
+            turn_lines.append(line)
         else:
             # If we haven't hit a turn marker yet, add to pre-battle
             pre_battle.append(line)
 
+    if current_turn is None:
+        yield 'pre_battle', pre_battle
+    else:
+        yield 'turn', (current_turn, turn_lines)
+
+def collect_turns(events):
+    """Assemble iter_log_turns events into the {'pre_battle', 'turns'} structure"""
+    pre_battle = []
+    turns = {}
+    for kind, value in events:
+        if kind == 'pre_battle':
+            pre_battle.extend(value)
+        elif kind == 'turn':
+            turn_number, lines = value
+            turns.setdefault(turn_number, []).extend(lines)
+
     # Structure the data
     return {
         'pre_battle': pre_battle,
         'turns': turns,
     }
+
+def format_as_turns(cleaned_log):
+    """Format the cleaned log as structured turn data"""
+    return collect_turns(iter_log_turns(cleaned_log.split('\n')))
+
+# Streaming path: read the replay JSON a chunk at a time and parse the log line by
+# line, so long replays never sit in memory as one string, a line list and a dict
+# at the same time.
+
+# Top-level fields kept from the replay besides the log
+STREAM_FIELDS = ('id', 'format', 'players')
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SURROGATE = re.compile('[\ud800-\udfff]')
+_JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class _JsonStream:
+    """Character reader over an iterable of bytes/str chunks, holding about one chunk"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self):
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def need(self, n=1):
+        """Make sure n characters are buffered; False at end of input"""
+        while len(self.buf) - self.pos < n:
+            if not self._fill():
+                return False
+        return True
+
+    def peek(self):
+        self.skip_ws()
+        if not self.need():
+            raise ValueError("Unexpected end of replay JSON")
+        return self.buf[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in replay JSON, got {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def skip_ws(self):
+        while self.need():
+            buf, pos = self.buf, self.pos
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            self.pos = pos
+            if pos < len(buf):
+                return
+
+    def string_segments(self):
+        """Yield decoded pieces of a JSON string whose opening quote was consumed"""
+        while True:
+            if not self.need():
+                raise ValueError("Unterminated string in replay JSON")
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                yield self.buf[self.pos:]
+                self.pos = len(self.buf)
+                continue
+            if match.start() > self.pos:
+                yield self.buf[self.pos:match.start()]
+            self.pos = match.start()
+            if self.buf[self.pos] == '"':
+                self.pos += 1
+                return
+            # Escape sequence, which may straddle a chunk boundary
+            if not self.need(2):
+                raise ValueError("Unterminated escape in replay JSON")
+            escape = self.buf[self.pos + 1]
+            if escape == 'u':
+                if not self.need(6):
+                    raise ValueError("Unterminated escape in replay JSON")
+                yield chr(int(self.buf[self.pos + 2:self.pos + 6], 16))
+                self.pos += 6
+            else:
+                yield _JSON_ESCAPES[escape]
+                self.pos += 2
+
+    def value(self, capture):
+        """Read one JSON value, returning it if capture is set (otherwise just skip it)"""
+        first = self.peek()
+        if first == '"':
+            self.pos += 1
+            if capture:
+                return _join_string(self.string_segments())
+            for _ in self.string_segments():
+                pass
+            return None
+
+        raw = []
+        depth = 0
+        while self.need():
+            char = self.buf[self.pos]
+            if char == '"':
+                self.pos += 1
+                text = _join_string(self.string_segments())
+                if capture:
+                    raw.append(json.dumps(text))
+                continue
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif char == ',' and depth == 0:
+                break
+            if capture:
+                raw.append(char)
+            self.pos += 1
+            if depth == 0 and char in '}]':
+                break
+        return json.loads(''.join(raw)) if capture else None
+
+def _join_string(segments):
+    text = ''.join(segments)
+    if _SURROGATE.search(text):
+        # Re-pair \uXXXX surrogate escapes into real characters
+        text = text.encode('utf-16', 'surrogatepass').decode('utf-16')
+    return text
+
+def _iter_log_lines(stream, fields):
+    """
+    Yield the raw log lines of a replay JSON object one at a time
+
+    Other top-level fields named in STREAM_FIELDS are stored in fields as they are
+    met (which may be after the log); everything else is skipped without keeping it.
+    """
+    stream.expect('{')
+    while True:
+        char = stream.peek()
+        stream.pos += 1
+        if char == '}':
+            return
+        if char == ',':
+            continue
+        if char != '"':
+            raise ValueError(f"Expected a key in replay JSON, got {char!r}")
+
+        key = _join_string(stream.string_segments())
+        stream.expect(':')
+        if key == 'log' and stream.peek() == '"':
+            stream.pos += 1
+            fields['log'] = True
+            partial = []
+            for segment in stream.string_segments():
+                pieces = segment.split('\n')
+                partial.append(pieces[0])
+                for piece in pieces[1:]:
+                    yield _join_string(partial)
+                    partial = [piece]
+            yield _join_string(partial)
+        else:
+            value = stream.value(capture=key in STREAM_FIELDS)
+            if key in STREAM_FIELDS:
+                fields[key] = value
+
+def iter_replay_stream(chunks):
+    """
+    Clean a replay JSON read incrementally, yielding turns as soon as they end
+
+    Args:
+        chunks: Iterable of bytes or str pieces of the replay JSON (e.g. iter_content)
+    Yields:
+        ('pre_battle', lines) and ('turn', (turn_number, lines)) events as in
+        iter_log_turns, then a final ('fields', {...}) with id/format/players.
+        Memory held at any point is about one chunk plus the turn being built.
+    """
+    vocab = get_vocabulary()
+    fields = {}
+    lines = _iter_log_lines(_JsonStream(chunks), fields)
+    kept = (line for line in lines if _keep_line(line, vocab))
+    first = next(kept, None)
+    if first is not None:
+        yield from iter_log_turns(itertools.chain([first], kept))
+    elif fields.get('log'):
+        # A log with nothing kept cleans to '', which format_as_turns reads as one empty line
+        yield from iter_log_turns([''])
+    yield 'fields', fields
+
+def clean_replay_stream(chunks):
+    """
+    Streaming counterpart of clean_replay_data for a replay JSON given in chunks
+
+    Returns:
+        Cleaned replay data as a dictionary
+    """
+    fields = {}
+
+    def turn_events():
+        for kind, value in iter_replay_stream(chunks):
+            if kind == 'fields':
+                fields.update(value)
+            else:
+                yield kind, value
+
+    pre_and_turns = collect_turns(turn_events())
+
+    cleaned_data = {
+        'id': fields.get('id', ''),
+        'format': fields.get('format', ''),
+        'players': fields.get('players', []),
+    }
+    if fields.get('log'):
+        cleaned_data.update(pre_and_turns)
+    return cleaned_data
+
+def stream_showdown_replay(url, chunk_size=64 * 1024):
+    """
+    Download and clean a Pokemon Showdown replay JSON without holding the whole body
+
+    Args:
+        url: URL of the replay JSON
+        chunk_size: Bytes read from the response at a time
+    Returns:
+        Cleaned replay data as a dictionary
+    """
+    print(f"Streaming from: {url}")
+    try:
+        with get(url, stream=True) as response:
+            response.raise_for_status()
+            cleaned_data = clean_replay_stream(response.iter_content(chunk_size))
+
+        print(f"Successfully cleaned replay {cleaned_data['id']}")
+        return cleaned_data
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
@@ -0,0 +1,263 @@
+import json
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .PS_vocab import DATA_DIR, get_vocabulary
+except ImportError:
+    from PS_vocab import DATA_DIR, get_vocabulary
+
+# Version 2 keys the table by format before species
+PRIORS_VERSION = 2
+
+DEFAULT_PRIORS_PATH = os.environ.get('PS_PRIORS_PATH', os.path.join(DATA_DIR, 'usage_priors.json'))
+
+# Set fields tracked per pokemon; moves are a list, the rest single values
+SET_FIELDS = ('moves', 'items', 'abilities', 'tera_types')
+
+# Most likely entries kept per species and field in the lookup table
+TOP_K = 8
+
+MAX_MOVES = 4
+
+# Team entry key for each single-valued field
+FIELD_KEYS = {'items': 'item', 'abilities': 'ability', 'tera_types': 'tera_type'}
+
+def _effect_source(parts: List[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Pull '[from] item: X' / '[from] ability: X' and '[of] position' out of an effect line"""
+    kind = value = of = None
+    for part in parts[3:]:
+        if part.startswith('[from] item: '):
+            kind, value = 'items', part[len('[from] item: '):]
+        elif part.startswith('[from] ability: '):
+            kind, value = 'abilities', part[len('[from] ability: '):]
+        elif part.startswith('[of] '):
+            of = part[len('[of] '):]
+    return kind, value, of
+
+def extract_reveals(cleaned_replay: Dict) -> Tuple[Dict[str, List[str]], List[Tuple[int, str, str, str, str]]]:
+    """
+    Walk a cleaned replay and collect what each side revealed about its team
+
+    Returns:
+        (teams, reveals) where teams maps 'p1'/'p2' to the team preview species and
+        reveals is a list of (turn, side, species, field, value) in log order
+    """
+    vocab = get_vocabulary()
+    teams = {'p1': [], 'p2': []}
+    reveals = []
+    nick_species = {}
+
+    def species_at(position):
+        side, nick = vocab.split_position(position)
+        return side, nick_species.get((side, nick), nick)
+
+    def reveal(turn, position, field, value):
+        side, species = species_at(position)
+        if side in teams and species and value:
+            reveals.append((turn, side, species, field, value))
+
+    turns = sorted(cleaned_replay.get('turns', {}).items(), key=lambda item: int(item[0]))
+    sections = [(0, cleaned_replay.get('pre_battle', []))] + [(int(num), lines) for num, lines in turns]
+
+    for turn, lines in sections:
+        for line in lines:
+            parts = line.split('|')
+            if len(parts) < 4:
+                continue
+            msg_type = parts[1]
+
+            if msg_type == 'poke':
+                if parts[2] in teams:
+                    teams[parts[2]].append(vocab.species_from_info(parts[3]))
+            elif msg_type in ('switch', 'drag', 'replace'):
+                side, nick = vocab.split_position(parts[2])
+                nick_species[(side, nick)] = vocab.species_from_info(parts[3])
+            elif msg_type == 'move':
+                # Moves called through another move or ability aren't part of the set
+                if any(p.startswith('[from]') and p != '[from]lockedmove' for p in parts[4:]):
+                    continue
+                if parts[3] != 'Struggle':
+                    reveal(turn, parts[2], 'moves', vocab.canonical('moves', parts[3]))
+            elif msg_type == '-terastallize':
+                reveal(turn, parts[2], 'tera_types', parts[3])
+            elif msg_type == '-ability':
+                reveal(turn, parts[2], 'abilities', vocab.canonical('abilities', parts[3]))
+            elif msg_type in ('-item', '-enditem'):
+                # Items received through Trick/Switcheroo weren't part of the set
+                if msg_type == '-item' and any(p.startswith('[from] move:') for p in parts[4:]):
+                    continue
+                reveal(turn, parts[2], 'items', vocab.canonical('items', parts[3]))
+            elif msg_type.startswith('-'):
+                kind, value, of = _effect_source(parts)
+                if kind:
+                    reveal(turn, of or parts[2], kind, vocab.canonical(kind, value))
+
+    return teams, reveals
+
+class UsagePriors:
+    """
+    Usage-stat priors built offline from our stored replays
+
+    Holds, per format and species, the TOP_K most common revealed moves, items,
+    abilities and tera types with their frequency. Formats are kept apart so a gen 5
+    set never gets inferred for a gen 9 game. Lookups are plain dict hits, so
+    inference adds next to nothing per replay.
+    """
+
+    def __init__(self, table: Optional[Dict] = None):
+        self.table = table or {}
+
+    @classmethod
+    def build(cls, cleaned_replays: Iterable[Dict]) -> 'UsagePriors':
+        """Count revealed set details across a corpus of cleaned replays"""
+        counts = defaultdict(lambda: defaultdict(lambda: {field: Counter() for field in SET_FIELDS}))
+        appearances = defaultdict(Counter)
+
+        for cleaned_replay in cleaned_replays:
+            fmt = cleaned_replay.get('format', '')
+            teams, reveals = extract_reveals(cleaned_replay)
+            for side in teams:
+                appearances[fmt].update(teams[side])
+            seen = set()
+            for _, side, species, field, value in reveals:
+                # Count each detail once per pokemon per game
+                key = (side, species, field, value)
+                if key not in seen:
+                    seen.add(key)
+                    counts[fmt][species][field][value] += 1
+
+        table = {}
+        for fmt, species_counts in counts.items():
+            table[fmt] = {}
+            for species, fields in species_counts.items():
+                total = max(appearances[fmt][species], 1)
+                table[fmt][species] = {
+                    'count': appearances[fmt][species],
+                    **{field: [(value, n / total) for value, n in fields[field].most_common(TOP_K)]
+                       for field in SET_FIELDS},
+                }
+        return cls(table)
+
+    def lookup(self, fmt: str, species: str, field: str) -> List[Tuple[str, float]]:
+        """Most likely values for a species' field in a format, best first"""
+        entry = self.table.get(fmt, {}).get(species)
+        return entry[field] if entry else []
+
+    def save(self, path: str = DEFAULT_PRIORS_PATH):
+        """Persist the priors as JSON, replacing the file atomically"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': PRIORS_VERSION, 'table': self.table}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_PRIORS_PATH) -> 'UsagePriors':
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != PRIORS_VERSION:
+            raise ValueError(f"Unsupported priors version {data.get('version')}, expected {PRIORS_VERSION}")
+        return cls({fmt: {species: {field: [tuple(entry) for entry in values] if field != 'count' else values
+                                    for field, values in fields.items()}
+                          for species, fields in species_table.items()}
+                    for fmt, species_table in data['table'].items()})
+
+def build_priors_from_db(cursor, path: str = DEFAULT_PRIORS_PATH) -> UsagePriors:
+    """Build usage priors from every replay stored in the database and save them"""
+    try:
+        from .db import fetchReplays
+    except ImportError:
+        from db import fetchReplays
+    priors = UsagePriors.build(fetchReplays(cursor))
+    priors.save(path)
+    species = sum(len(species_table) for species_table in priors.table.values())
+    print(f"Built usage priors for {species} species across {len(priors.table)} formats")
+    return priors
+
+class HiddenInfoReconstructor:
+    """
+    Turn the shared spectator view into what each player could actually know
+
+    A player knows their own full set from the start, so 'my_team' gets everything
+    their side reveals during the game, with unrevealed moves, items, abilities and
+    tera types filled in from the usage priors (and listed under 'inferred').
+    The opponent's team starts as just the team preview; its details only show up
+    in each turn's 'opponent_reveals' on the turn they are revealed, so nothing
+    from later in the game leaks into earlier observations.
+    """
+
+    def __init__(self, priors: Optional[UsagePriors] = None):
+        self.priors = priors if priors is not None else UsagePriors()
+
+    def _apply_reveal(self, team: Dict[str, Dict], species: str, field: str, value: str):
+        member = team.setdefault(species, {'moves': [], 'item': None, 'ability': None, 'tera_type': None})
+        if field == 'moves':
+            if value not in member['moves']:
+                member['moves'].append(value)
+        elif member[FIELD_KEYS[field]] is None:
+            member[FIELD_KEYS[field]] = value
+
+    def _known_team(self, species_list: List[str], reveals: List[Tuple], side: str) -> Dict[str, Dict]:
+        team = {species: {'moves': [], 'item': None, 'ability': None, 'tera_type': None}
+                for species in species_list}
+        for _, reveal_side, species, field, value in reveals:
+            if reveal_side == side:
+                self._apply_reveal(team, species, field, value)
+        for member in team.values():
+            member['inferred'] = []
+        return team
+
+    def _fill_from_priors(self, team: Dict[str, Dict], fmt: str):
+        for species, member in team.items():
+            for value, _ in self.priors.lookup(fmt, species, 'moves'):
+                if len(member['moves']) >= MAX_MOVES:
+                    break
+                if value not in member['moves']:
+                    member['moves'].append(value)
+                    if 'moves' not in member['inferred']:
+                        member['inferred'].append('moves')
+            for field in ('items', 'abilities', 'tera_types'):
+                key = FIELD_KEYS[field]
+                if member[key] is None:
+                    candidates = self.priors.lookup(fmt, species, field)
+                    if candidates:
+                        member[key] = candidates[0][0]
+                        member['inferred'].append(key)
+
+    def reconstruct(self, cleaned_replay: Dict, perspectives: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Fill in each perspective's game state and per-turn opponent reveals in place"""
+        teams, reveals = extract_reveals(cleaned_replay)
+
+        for perspective in perspectives.values():
+            my_side = perspective['player_id']
+            opponent_side = perspective['opponent_id']
+
+            my_team = self._known_team(teams.get(my_side, []), reveals, my_side)
+            self._fill_from_priors(my_team, cleaned_replay.get('format', ''))
+
+            game_state = perspective['game_state']
+            game_state['my_team'] = my_team
+            game_state['opponent_team'] = {
+                species: {'moves': [], 'item': None, 'ability': None, 'tera_type': None}
+                for species in teams.get(opponent_side, [])
+            }
+
+            for turn in perspective['turns'].values():
+                turn['opponent_reveals'] = []
+            revealed = set()
+            for turn_num, side, species, field, value in reveals:
+                # Only the first time a detail shows up counts as a reveal
+                if side != opponent_side or (species, field, value) in revealed:
+                    continue
+                revealed.add((species, field, value))
+                if turn_num == 0:
+                    # Revealed before the first turn (e.g. a lead's Intimidate)
+                    self._apply_reveal(game_state['opponent_team'], species, field, value)
+                    continue
+                turn = perspective['turns'].get(turn_num, perspective['turns'].get(str(turn_num)))
+                if turn is not None:
+                    turn['opponent_reveals'].append({'pokemon': species, 'field': field, 'value': value})
+
+        return perspectives
@@ -1,24 +1,31 @@
-import requests
 import json
 import os
 from datetime import datetime
 import time
 
-def fetch_gen9ou_replays(page=1, limit=50):
+try:
+    from .PS_http import get, replay_url
+except ImportError:
+    from PS_http import get, replay_url
+
+def fetch_gen9ou_replays(page=1, limit=50, max_pages=3):
     """
     Fetch recent Gen 9 OU replays from Pokemon Showdown
     
     Args:
         page: Page number (starts at 1)
         limit: Maximum number of replays to fetch per page
+        max_pages: Last page to follow (the live site is only crawled 3 deep)
         
     Returns:
         List of replay data with only the fields we care about
     """
-    url = f"https://replay.pokemonshowdown.com/search.json?format=gen9ou&page={page}"
+    import requests  # Loaded on first fetch so parsing-only imports stay light
+
+    url = replay_url(f"search.json?format=gen9ou&page={page}")
     
     try:
-        response = requests.get(url)
+        response = get(url)
         response.raise_for_status()
         
         data = response.json()
@@ -36,12 +43,10 @@ def fetch_gen9ou_replays(page=1, limit=50):
             rating = replay.get('rating')
             
             if replay_id and players:
-                replay_url = f"https://replay.pokemonshowdown.com/{replay_id}.json"
-                
                 processed_data.append({
                     'players': players,
                     'rating': rating,
-                    'replay_url': replay_url
+                    'replay_url': replay_url(f"{replay_id}.json")
                 })
         
         # If we have more results than the limit, trim the list
@@ -51,13 +56,14 @@ def fetch_gen9ou_replays(page=1, limit=50):
         # Check if we should fetch more pages
         has_more_pages = len(data) > 50
         
-        if has_more_pages and page < 3:  # Limit to 3 pages
-            next_page_data = fetch_gen9ou_replays(page + 1, limit)
+        if has_more_pages and page < max_pages:
+            next_page_data = fetch_gen9ou_replays(page + 1, limit, max_pages)
             processed_data.extend(next_page_data)
             
         return processed_data
         
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # ValueError covers bad JSON from recorded responses (json.JSONDecodeError)
         print(f"Error fetching replays: {e}")
         return []
 if __name__ == "__main__":
@@ -0,0 +1,301 @@
+import glob
+import os
+from typing import Dict, Iterator, List, Optional
+
+try:
+    from .PS_vocab import Vocabulary, get_vocabulary
+except ImportError:
+    from PS_vocab import Vocabulary, get_vocabulary
+
+# Numeric columns of each observation row
+OBS_FIELDS = (
+    'turn_number',
+    'my_active_hp',
+    'opponent_active_hp',
+    'my_fainted',
+    'opponent_fainted',
+)
+
+# Per-step string columns, encoded to vocabulary ids when shards are written.
+# Keeping names until then means trajectories from different pool workers
+# (each with its own copy of the vocabulary) all share one id space.
+ACTIVE_FIELDS = ('my_active', 'opponent_active')
+
+# action_type values
+ACTION_NONE = 0
+ACTION_MOVE = 1
+ACTION_SWITCH = 2
+
+TERMINAL_REWARD = 1.0
+
+def parse_hp(hp_info: Optional[str]) -> Optional[float]:
+    """Turn an HP string like '72/100', '45/100 par' or '0 fnt' into a 0-1 fraction"""
+    if not hp_info:
+        return None
+    hp = hp_info.split(' ')[0]
+    if '/' not in hp:
+        return 0.0 if hp == '0' else None
+    current, maximum = hp.split('/', 1)
+    try:
+        return float(current) / float(maximum)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+class TrajectoryBuilder:
+    """
+    Build one player's (obs, action, reward, done) arrays while the converter parses
+
+    Fed the first-person turns as they are produced, so no second pass over the
+    replay is needed. Each step's observation is the state at the start of the turn,
+    the action is the first move or switch the player made during it (none if their
+    active fainted first; the forced replacement isn't the turn's choice), and the
+    reward is the terminal win/loss (on the last step) plus optional shaping.
+    Active species and actions are kept as names; TrajectoryShardWriter encodes them.
+    """
+
+    def __init__(self, player_id: str, player_name: str, vocab: Vocabulary,
+                 shaping: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            player_id: 'p1' or 'p2'
+            player_name: Name compared against the |win| line
+            vocab: Vocabulary used to parse positions and details
+            shaping: Optional weights, 'faint' per faint and 'hp' per fraction of HP
+                lost, both counted positive for the opponent and negative for us
+        """
+        self.player_id = player_id
+        self.player_name = player_name
+        self.vocab = vocab
+        self.shaping = shaping or {}
+        self.state = {field: 0.0 for field in OBS_FIELDS}
+        self.state['my_active_hp'] = self.state['opponent_active_hp'] = 1.0
+        self.active = {field: '' for field in ACTIVE_FIELDS}
+        self.obs = []
+        self.my_active = []
+        self.opponent_active = []
+        self.action_type = []
+        self.action = []
+        self.reward = []
+        self.done = []
+        self.action_history = []
+
+    def observe_pre_battle(self, pre_battle: List[Dict]):
+        """Pick up the leads from the converted pre-battle events"""
+        for event in pre_battle:
+            raw = event['data'].get('raw', '')
+            if raw.startswith('|switch|'):
+                parts = raw.split('|')
+                if len(parts) > 3:
+                    side, _ = self.vocab.split_position(parts[2])
+                    self._switch_in(side == self.player_id, parts[3], parts[4] if len(parts) > 4 else None)
+
+    def _switch_in(self, mine: bool, pokemon_info: str, hp_info: Optional[str]):
+        prefix = 'my' if mine else 'opponent'
+        self.active[f'{prefix}_active'] = self.vocab.species_from_info(pokemon_info)
+        hp = parse_hp(hp_info)
+        self.state[f'{prefix}_active_hp'] = 1.0 if hp is None else hp
+
+    def observe_turn(self, turn_num, fp_turn: Dict):
+        """Record one step from a converted first-person turn"""
+        self.state['turn_number'] = float(turn_num)
+        self.obs.append([self.state[field] for field in OBS_FIELDS])
+        self.my_active.append(self.active['my_active'])
+        self.opponent_active.append(self.active['opponent_active'])
+
+        action_type, action = ACTION_NONE, ''
+        # Once our active faints without having acted, the turn's choice was lost;
+        # the replacement switch that follows is a forced decision, not this turn's action
+        can_act = True
+        reward = 0.0
+        winner = None
+        faint_weight = self.shaping.get('faint', 0.0)
+        hp_weight = self.shaping.get('hp', 0.0)
+
+        for event in fp_turn['observations']:
+            event_type = event['type']
+            data = event['data']
+            mine = event['perspective'] == 'self'
+            prefix = 'my' if mine else 'opponent'
+            sign = -1.0 if mine else 1.0
+
+            if event_type == 'move' and 'move' in data:
+                if mine and can_act and action_type == ACTION_NONE:
+                    action_type, action = ACTION_MOVE, data['move']
+            elif event_type in ('switch', 'drag') and 'pokemon_info' in data:
+                if mine and can_act and event_type == 'switch' and action_type == ACTION_NONE:
+                    action_type, action = ACTION_SWITCH, data['pokemon_name']
+                self._switch_in(mine, data['pokemon_info'], data['hp_info'])
+            elif event_type in ('damage', 'heal') and 'new_hp' in data:
+                hp = parse_hp(data['new_hp'])
+                if hp is not None:
+                    reward += sign * hp_weight * (self.state[f'{prefix}_active_hp'] - hp)
+                    self.state[f'{prefix}_active_hp'] = hp
+            elif event_type == 'faint' and 'position' in data:
+                self.state[f'{prefix}_fainted'] += 1.0
+                reward += sign * faint_weight
+                if mine and action_type == ACTION_NONE:
+                    can_act = False
+            elif event_type == 'win':
+                winner = data.get('raw', '').split('|')[-1]
+
+        if winner is not None:
+            reward += TERMINAL_REWARD if winner == self.player_name else -TERMINAL_REWARD
+
+        self.action_type.append(action_type)
+        self.action.append(action)
+        self.reward.append(reward)
+        self.done.append(winner is not None)
+        self.action_history.append({'turn': turn_num, 'action_type': action_type, 'action': action or None})
+
+    def finish(self) -> Dict[str, List]:
+        """Aligned per-step lists; the last step is always marked done"""
+        if self.done:
+            self.done[-1] = True
+        return {
+            'obs': self.obs,
+            'my_active': self.my_active,
+            'opponent_active': self.opponent_active,
+            'action_type': self.action_type,
+            'action': self.action,
+            'reward': self.reward,
+            'done': self.done,
+        }
+
+class TrajectoryShardWriter:
+    """
+    Append converted perspectives' trajectories to fixed-size .npz shards
+
+    Each shard holds obs (N, len(OBS_FIELDS)) float32, my_active / opponent_active
+    int32 species ids, action_type int8, action int32 (a move id for moves, a species
+    id for switches), reward float32, done bool and episode int32 (index of the
+    episode within the directory). The vocabulary is saved next to the shards on close
+    so the ids can be decoded. A training loop streams them back with iter_shards().
+
+    Writing into a directory that already has shards appends to it: ids are encoded
+    with the directory's own vocab.json (the vocab argument only seeds a new
+    directory) and episode numbers continue from the last shard.
+    """
+
+    def __init__(self, out_dir: str, shard_size: int = 65536, prefix: str = 'trajectories',
+                 vocab: Optional[Vocabulary] = None, auto_write: bool = True):
+        """
+        Args:
+            auto_write: Write a shard as soon as shard_size steps are buffered. When
+                False nothing is written until flush(), so a caller can line shards
+                up with its own commit points (each shard then holds at least
+                shard_size steps whenever the caller waits for buffered_rows).
+        """
+        import numpy as np  # Only needed when exporting
+        self.np = np
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.auto_write = auto_write
+
+        vocab_path = os.path.join(out_dir, 'vocab.json')
+        if os.path.exists(vocab_path):
+            # Existing shards were encoded with this mapping, so keep using it
+            self.vocab = Vocabulary.load(vocab_path)
+        else:
+            self.vocab = vocab if vocab is not None else get_vocabulary()
+
+        existing = sorted(glob.glob(os.path.join(out_dir, f'{prefix}-*.npz')))
+        self.shards_written = len(existing)
+        self.episodes = 0
+        if existing:
+            with np.load(existing[-1]) as shard:
+                if len(shard['episode']):
+                    self.episodes = int(shard['episode'].max()) + 1
+        self._buffer = {key: [] for key in ('obs', 'my_active', 'opponent_active', 'action_type',
+                                            'action', 'reward', 'done', 'episode')}
+        self._rows = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def add(self, perspective: Dict):
+        """Buffer one perspective's trajectory, writing shards as they fill up"""
+        trajectory = perspective.get('trajectory')
+        if not trajectory or not trajectory['obs']:
+            return
+        steps = len(trajectory['obs'])
+        vocab = self.vocab
+        for key in ('obs', 'action_type', 'reward', 'done'):
+            self._buffer[key].extend(trajectory[key])
+        for key in ACTIVE_FIELDS:
+            self._buffer[key].extend(vocab.encode('species', trajectory[key]))
+        self._buffer['action'].extend(
+            vocab.intern('species' if action_type == ACTION_SWITCH else 'moves', action)
+            for action_type, action in zip(trajectory['action_type'], trajectory['action'])
+        )
+        self._buffer['episode'].extend([self.episodes] * steps)
+        self.episodes += 1
+        self._rows += steps
+        while self.auto_write and self._rows >= self.shard_size:
+            self._write(self.shard_size)
+
+    @property
+    def buffered_rows(self) -> int:
+        """Steps added but not yet written to a shard"""
+        return self._rows
+
+    def checkpoint(self):
+        """Mark the end of the buffer so later add()s can be undone with rollback()"""
+        return self._rows, self.episodes
+
+    def rollback(self, checkpoint):
+        """
+        Drop everything buffered since checkpoint(), including a half-finished add()
+
+        Only rows still in the buffer can be dropped, so this is for auto_write=False
+        writers that haven't flushed since the checkpoint.
+        """
+        rows, episodes = checkpoint
+        if rows > self._rows:
+            raise ValueError("Rows added since the checkpoint were already written to a shard")
+        for values in self._buffer.values():
+            del values[rows:]
+        self._rows = rows
+        self.episodes = episodes
+
+    def _write(self, rows: int):
+        np = self.np
+        path = os.path.join(self.out_dir, f'{self.prefix}-{self.shards_written:05d}.npz')
+        buf = self._buffer
+        np.savez(
+            path,
+            obs=np.asarray(buf['obs'][:rows], dtype=np.float32).reshape(rows, len(OBS_FIELDS)),
+            my_active=np.asarray(buf['my_active'][:rows], dtype=np.int32),
+            opponent_active=np.asarray(buf['opponent_active'][:rows], dtype=np.int32),
+            action_type=np.asarray(buf['action_type'][:rows], dtype=np.int8),
+            action=np.asarray(buf['action'][:rows], dtype=np.int32),
+            reward=np.asarray(buf['reward'][:rows], dtype=np.float32),
+            done=np.asarray(buf['done'][:rows], dtype=bool),
+            episode=np.asarray(buf['episode'][:rows], dtype=np.int32),
+        )
+        for key in buf:
+            del buf[key][:rows]
+        self._rows -= rows
+        self.shards_written += 1
+        print(f"Wrote {rows} steps to {path}")
+
+    def flush(self):
+        """Write whatever is buffered as a (smaller) shard, along with the vocabulary"""
+        if self._rows:
+            self._write(self._rows)
+        self.vocab.save(os.path.join(self.out_dir, 'vocab.json'))
+
+    def close(self):
+        """Write whatever is left as a final, smaller shard"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_shards(out_dir: str, prefix: str = 'trajectories') -> Iterator[Dict]:
+    """Stream shards written by TrajectoryShardWriter in order, one dict of arrays each"""
+    import numpy as np
+    for path in sorted(glob.glob(os.path.join(out_dir, f'{prefix}-*.npz'))):
+        with np.load(path) as shard:
+            yield {key: shard[key] for key in shard.files}
@@ -0,0 +1,178 @@
+import json
+import os
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Bump when the on-disk layout changes; ids inside a table are append-only
+VOCAB_VERSION = 1
+
+# Tables every vocabulary carries
+CATEGORIES = ('species', 'moves', 'items', 'abilities', 'positions', 'message_types')
+
+# Id 0 in every table is reserved for missing/unknown values (tensor padding)
+UNKNOWN = ''
+
+# Parse caches are emptied when they reach this size; positions carry free-text
+# nicknames, so a long-lived worker would otherwise grow them without limit
+MAX_CACHE_ENTRIES = 100000
+
+# Generated state (vocabulary, usage priors) lives outside the source package
+DATA_DIR = os.environ.get('PS_DATA_DIR', os.path.join(os.path.expanduser('~'), '.ps_replay_data'))
+
+DEFAULT_VOCAB_PATH = os.environ.get('PS_VOCAB_PATH', os.path.join(DATA_DIR, 'vocab.json'))
+
+class Vocabulary:
+    """
+    Shared intern tables mapping species, moves, items, abilities, positions and
+    protocol message types to small integer ids.
+
+    Every string handed out by the vocabulary is the canonical (sys.intern'd)
+    object for that value, so events built from it share memory instead of
+    allocating a fresh copy per line. The ids double as the tensor encoding.
+    """
+
+    def __init__(self):
+        self.ids = {category: {UNKNOWN: 0} for category in CATEGORIES}
+        self.strings = {category: [UNKNOWN] for category in CATEGORIES}
+        # Parse caches keyed on the raw protocol fragment
+        self._positions = {}
+        self._species_info = {}
+
+    def intern(self, category: str, value: Optional[str]) -> int:
+        """Return the id for value, adding it to the category table if needed"""
+        if not value:
+            return 0
+        table = self.ids[category]
+        idx = table.get(value)
+        if idx is None:
+            idx = len(self.strings[category])
+            value = sys.intern(value)
+            table[value] = idx
+            self.strings[category].append(value)
+        return idx
+
+    def canonical(self, category: str, value: Optional[str]) -> Optional[str]:
+        """Return the shared string object for value (interning it if new)"""
+        if not value:
+            return value
+        return self.strings[category][self.intern(category, value)]
+
+    def lookup(self, category: str, idx: int) -> str:
+        """Return the string stored under idx in the category table"""
+        return self.strings[category][idx]
+
+    def encode(self, category: str, values: Iterable[Optional[str]]) -> List[int]:
+        """Encode a sequence of strings as ids"""
+        return [self.intern(category, value) for value in values]
+
+    def decode(self, category: str, ids: Iterable[int]) -> List[str]:
+        """Decode a sequence of ids back into strings"""
+        strings = self.strings[category]
+        return [strings[idx] for idx in ids]
+
+    def size(self, category: str) -> int:
+        """Number of ids in use for the category, including the unknown id"""
+        return len(self.strings[category])
+
+    def position(self, position: Optional[str]) -> Optional[str]:
+        """
+        Return the shared string object for a position like 'p1a: Gholdengo'
+
+        Only the slot ('p1a') is added to the positions table. The part after ': '
+        is a nickname (or a player name for 'p1: X'), so it is interned for
+        sharing but never persisted or given an id.
+        """
+        if not position:
+            return position
+        return self._parse_position(position)[0]
+
+    def split_position(self, position: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Split a position like 'p1a: Gholdengo' into (player id, pokemon nickname)
+
+        Results are cached per position string, so each distinct position is only
+        parsed once.
+        """
+        if not position:
+            return None, None
+        return self._parse_position(position)[1:]
+
+    def _parse_position(self, position: str) -> Tuple[str, Optional[str], Optional[str]]:
+        cached = self._positions.get(position)
+        if cached is None:
+            if len(self._positions) >= MAX_CACHE_ENTRIES:
+                self._positions.clear()
+            slot, separator, name = position.partition(': ')
+            player = position[:2] if position[:2] in ('p1', 'p2') else None
+            if player is not None:
+                # Effect arguments such as '-message' text also land here; skip them
+                self.intern('positions', slot.strip())
+            name = sys.intern(name.strip()) if separator else None
+            position = sys.intern(position)
+            cached = (position, player, name)
+            self._positions[position] = cached
+        return cached
+
+    def species_from_info(self, pokemon_info: Optional[str]) -> str:
+        """Extract the species from a details string like 'Charizard, L50, M'"""
+        if not pokemon_info:
+            return ''
+        species = self._species_info.get(pokemon_info)
+        if species is None:
+            if len(self._species_info) >= MAX_CACHE_ENTRIES:
+                self._species_info.clear()
+            species = self.canonical('species', pokemon_info.split(',')[0].strip())
+            self._species_info[pokemon_info] = species
+        return species
+
+    def to_dict(self) -> Dict:
+        """Serializable form of the vocabulary"""
+        return {
+            'version': VOCAB_VERSION,
+            'tables': {category: self.strings[category] for category in CATEGORIES},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Vocabulary':
+        """Rebuild a vocabulary from its serialized form"""
+        version = data.get('version')
+        if version != VOCAB_VERSION:
+            raise ValueError(f"Unsupported vocabulary version {version}, expected {VOCAB_VERSION}")
+        vocab = cls()
+        for category, strings in data.get('tables', {}).items():
+            if category not in vocab.ids:
+                continue
+            for value in strings[1:]:
+                vocab.intern(category, value)
+        return vocab
+
+    def save(self, path: str = DEFAULT_VOCAB_PATH):
+        """Persist the vocabulary as JSON, replacing the file atomically"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_VOCAB_PATH) -> 'Vocabulary':
+        """Load a vocabulary saved with save()"""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+# Process-wide vocabulary shared by the cleaner, converter and exporters
+_default_vocabulary = None
+
+def get_vocabulary() -> Vocabulary:
+    """Return the shared vocabulary, loading it from DEFAULT_VOCAB_PATH on first use"""
+    global _default_vocabulary
+    if _default_vocabulary is None:
+        if os.path.exists(DEFAULT_VOCAB_PATH):
+            _default_vocabulary = Vocabulary.load(DEFAULT_VOCAB_PATH)
+        else:
+            _default_vocabulary = Vocabulary()
+    return _default_vocabulary
+
+def save_vocabulary(path: str = DEFAULT_VOCAB_PATH):
+    """Persist the shared vocabulary so ids stay stable across runs"""
+    get_vocabulary().save(path)
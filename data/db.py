@@ -1,8 +1,33 @@
-import mysql.connector
+import json
+import os
 
+# Nothing here touches the network at import time: mysql.connector is only
+# imported, and a connection only opened, the first time one is needed.
 
+def loadConfig():
+    # Credentials come from the untracked passworddb module when it exists,
+    # otherwise from PS_DB_* environment variables
+    try:
+        import passworddb
+        return {
+            'host': passworddb.HOST,
+            'user': passworddb.USER,
+            'password': passworddb.PASSWORD,
+            'database': passworddb.DATABASE,
+            'port': passworddb.PORT,
+        }
+    except ImportError:
+        return {
+            'host': os.environ.get('PS_DB_HOST', 'localhost'),
+            'user': os.environ.get('PS_DB_USER', ''),
+            'password': os.environ.get('PS_DB_PASSWORD', ''),
+            'database': os.environ.get('PS_DB_DATABASE', ''),
+            'port': int(os.environ.get('PS_DB_PORT', '3306')),
+        }
 
 def connectToDB(host, user, password, database, port):
+    import mysql.connector
+
     # Connect without specifying a database first
     print("Connecting to cloud service")
     conn = mysql.connector.connect(
@@ -22,10 +47,23 @@ def connectToDB(host, user, password, database, port):
 
     return cursor, conn
 
+# Connection shared by callers that use getConnection(), opened on first use
+_cursor = None
+_conn = None
 
-print("Attempting to connect to cloud service")
-cursor, conn = connectToDB(HOST, USER, PASSWORD, DATABASE, PORT)
-print("Out of connection function")
+def getConnection():
+    global _cursor, _conn
+    if _conn is None:
+        config = loadConfig()
+        _cursor, _conn = connectToDB(**config)
+    return _cursor, _conn
+
+def closeConnection():
+    global _cursor, _conn
+    if _conn is not None:
+        _cursor.close()
+        _conn.close()
+        _cursor, _conn = None, None
 
 def createDatabase(cursor, database):
     # Create a new database
@@ -33,8 +71,6 @@ def createDatabase(cursor, database):
     cursor.execute(queryString)
     print("Database created or already exists")
 
-createDatabase(cursor, DATABASE)
-
 def createTable(cursor):
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS data (
@@ -42,44 +78,131 @@ def createTable(cursor):
         game_id VARCHAR(255) UNIQUE,
         json TEXT,
         elo INT,
+        tags VARCHAR(255) DEFAULT '',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
 
     """)
+    # Tables created before filter tags were stored don't have the column yet
+    cursor.execute("SHOW COLUMNS FROM data LIKE 'tags'")
+    if cursor.fetchone() is None:
+        cursor.execute("ALTER TABLE data ADD COLUMN tags VARCHAR(255) DEFAULT '' AFTER elo")
     print("Table created successfully or table already created")
 
+def extractElo(data):
+    # Safely extract ELO values
+    try:
+        # New format handling
+        p1_elo = data["pre_battle"][0].split('|')[-1]  # Gets the last part after |
+        p2_elo = data["pre_battle"][1].split('|')[-1]  # Gets the last part after |
+        
+        return (int(p1_elo) + int(p2_elo)) / 2
+    except (IndexError, ValueError, KeyError):
+        # Fallback if ELO data isn't available
+        return 0
+
+FINGERPRINT_SQL = "INSERT IGNORE INTO fingerprints (fingerprint, game_id) VALUES (%s, %s)"
+DATA_SQL = "INSERT IGNORE INTO data (game_id, json, elo, tags) VALUES (%s, %s, %s, %s)"
 
-import json
+def joinTags(tags):
+    # Filter tags (tag_only rules a replay broke) are stored comma separated
+    return ','.join(tags or ())
 
-def insertJSON(cursor, conn, data):
+def insertJSON(cursor, conn, data, fingerprint=None, tags=()):
+    # The fingerprint row (if any) is committed in the same transaction as the
+    # replay, so a failed insert never leaves the game marked as seen
     try:
         game_id = data["id"]
         json_text = json.dumps(data)
+        elo = extractElo(data)
+        print(f"ELO  = ${elo}")
         
-        # Safely extract ELO values
-        try:
-            # New format handling
-            p1_elo = data["pre_battle"][0].split('|')[-1]  # Gets the last part after |
-            p2_elo = data["pre_battle"][1].split('|')[-1]  # Gets the last part after |
-            
-            elo = (int(p1_elo) + int(p2_elo)) / 2
-            print(f"ELO  = ${elo}, elo 1 = ${p1_elo} elo 2 = ${p2_elo}")
-            print(f"data[pre_battle][2] = ${data['pre_battle'][2].split('|')} ")
-        except (IndexError, ValueError):
-            # Fallback if ELO data isn't available
-            elo = 0
-        
-        sql = "INSERT IGNORE INTO data (game_id, json, elo) VALUES (%s, %s, %s)"
-        val = (game_id, json_text, elo)
+        val = (game_id, json_text, elo, joinTags(tags))
         
-        cursor.execute(sql, val)
+        cursor.execute(DATA_SQL, val)
+        if fingerprint:
+            cursor.execute(FINGERPRINT_SQL, (fingerprint, game_id))
         conn.commit()
         print(f"Successfully inserted row for {game_id}")
         return True
     except Exception as e:
         print(f"Error inserting data for {data.get('id', 'unknown')}: {str(e)}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
         return False
 
+def insertManyJSON(cursor, conn, rows, fingerprints=(), tags=None):
+    # Insert a batch of cleaned replays and their (fingerprint, game_id) rows
+    # with a single commit; on error nothing from the batch is kept. tags, when
+    # given, holds each row's filter tags in the same order as rows
+    tags = list(tags) if tags is not None else [()] * len(rows)
+    values = [(data["id"], json.dumps(data), extractElo(data), joinTags(row_tags))
+              for data, row_tags in zip(rows, tags)]
+    fingerprints = list(fingerprints)
+    if not values and not fingerprints:
+        return 0
+    try:
+        if values:
+            cursor.executemany(DATA_SQL, values)
+        if fingerprints:
+            cursor.executemany(FINGERPRINT_SQL, fingerprints)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(values)
+
+def createFingerprintTable(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        fingerprint CHAR(32) PRIMARY KEY,
+        game_id VARCHAR(255),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    """)
+    print("Fingerprint table created successfully or table already created")
+
+def insertFingerprint(cursor, conn, fingerprint, game_id):
+    cursor.execute(FINGERPRINT_SQL, (fingerprint, game_id))
+    conn.commit()
+
+def fingerprintExists(cursor, fingerprint):
+    cursor.execute("SELECT 1 FROM fingerprints WHERE fingerprint = %s LIMIT 1", (fingerprint,))
+    return cursor.fetchone() is not None
+
+def fetchFingerprints(cursor, batch_size=10000):
+    # Stream fingerprints in batches so seeding doesn't load the table at once
+    cursor.execute("SELECT fingerprint FROM fingerprints")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row[0]
+
+def fetchReplays(cursor, batch_size=500):
+    # Stream stored replays as dicts without loading the whole table
+    cursor.execute("SELECT json FROM data")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield json.loads(row[0])
+
+def fetchReplayRows(cursor, after_id=0, batch_size=1000):
+    # Stream (id, json, elo) rows newer than after_id, oldest first
+    cursor.execute("SELECT id, json, elo FROM data WHERE id > %s ORDER BY id", (after_id,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
 def printRows(cursor):
     query = "SELECT * FROM data"
     cursor.execute(query)
@@ -88,8 +211,3 @@ def printRows(cursor):
 
     for row in rows:
         print(row)
-
-
-cursor.close()
-conn.close()
-
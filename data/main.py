@@ -2,16 +2,13 @@ import os
 import time
 from datetime import datetime
 from PS_scraper import fetch_gen9ou_replays
-from PS_json_cleaner import clean_showdown_replay
-from db import connectToDB, createDatabase, createTable, insertJSON, printRows
-import passworddb
+from PS_json_cleaner import stream_showdown_replay
+from PS_filter import ReplayFilter
+from PS_vocab import save_vocabulary
+from db import loadConfig, connectToDB, createDatabase, createTable, createFingerprintTable, insertJSON, printRows
 
 def main():
-    HOST = passworddb.HOST
-    USER = passworddb.USER
-    PASSWORD = passworddb.PASSWORD
-    DATABASE = passworddb.DATABASE
-    PORT = passworddb.PORT
+    config = loadConfig()
     
     # Get current timestamp for logging
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -19,9 +16,11 @@ def main():
     # Connect to database
     try:
         print(f"[{timestamp}] Connecting to database...")
-        cursor, conn = connectToDB(HOST, USER, PASSWORD, DATABASE, PORT)
-        createDatabase(cursor, DATABASE)
+        cursor, conn = connectToDB(**config)
+        createDatabase(cursor, config['database'])
         createTable(cursor)
+        createFingerprintTable(cursor)
+        replay_filter = ReplayFilter(cursor=cursor, conn=conn)
         print(f"[{timestamp}] Successfully connected to database")
     except Exception as e:
         print(f"[{timestamp}] Failed to connect to database: {e}")
@@ -57,19 +56,29 @@ def main():
         print(f"[{timestamp}] Processing replay {i+1}/{len(replays)}: {replay_id}")
         
         try:
-            # Clean the replay data - now returns data directly
-            cleaned_data = clean_showdown_replay(replay_url)
+            # Clean the replay data while it downloads - returns data directly
+            cleaned_data = stream_showdown_replay(replay_url)
             
-            if cleaned_data:
+            if cleaned_data and not replay_filter.accept(cleaned_data):
+                print(f"[{timestamp}] - Skipping {replay_id}: duplicate or incomplete")
+            elif cleaned_data:
                 successful += 1
                 print(f"[{timestamp}] ✓ Successfully processed {replay_id}")
                 
-                # Insert into database directly with the cleaned data
+                # Insert into database directly with the cleaned data; the game only
+                # counts as seen once its row is stored, so failures retry next cycle
                 try:
-                    insertJSON(cursor, conn, cleaned_data)
-                    db_successful += 1
-                    print(f"[{timestamp}] ✓ Successfully uploaded {replay_id} to database")
+                    if insertJSON(cursor, conn, cleaned_data, replay_filter.fingerprint_of(cleaned_data),
+                                  replay_filter.tags_of(cleaned_data)):
+                        replay_filter.mark_seen([cleaned_data])
+                        db_successful += 1
+                        print(f"[{timestamp}] ✓ Successfully uploaded {replay_id} to database")
+                    else:
+                        replay_filter.release([cleaned_data])
+                        db_failed += 1
+                        print(f"[{timestamp}] ✗ Failed to upload {replay_id} to database")
                 except Exception as e:
+                    replay_filter.release([cleaned_data])
                     db_failed += 1
                     print(f"[{timestamp}] ✗ Failed to upload {replay_id} to database: {e}")
             else:
@@ -91,6 +100,9 @@ def main():
     cursor.close()
     conn.close()
     
+    # Keep vocabulary ids stable for the next cycle and other tools
+    save_vocabulary()
+    
     # Print summary
     print(f"\n[{timestamp}] Processing complete")
     print(f"Total replays: {len(replays)}")
@@ -98,6 +110,7 @@ def main():
     print(f"Failed processing: {failed}")
     print(f"Successfully uploaded to DB: {db_successful}")
     print(f"Failed DB uploads: {db_failed}")
+    print(f"Filter results: {replay_filter.report()}")
 
 if __name__ == "__main__":
     while True: